@@ -2,11 +2,22 @@ from orbit.target_identification.target_identification import *
 from orbit.nsvs.model_checker.frame_validator import *
 from orbit.nsvs.video.read_video import *
 from orbit.datamanager.egoexo4d import *
+from orbit.nsvs.vlm.metrics import VLMMetrics
+from orbit.nsvs.vlm.router import VLLMRouter
+from orbit.utils.work_queue import LeaseKeeper, WorkQueue, default_worker_id
+from orbit.utils.checkpoint import CheckpointKeys, JsonlCheckpoint, compact_checkpoints, config_hash, load_checkpoints
+from orbit.utils.pipeline import StageScheduler
+from orbit.utils import profiling, tracing
 from orbit.nsvs.vlm.obj import *
 from orbit.nsvs.nsvs import *
 from orbit.puls.puls import *
 
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+import threading
+import argparse
 import json
+import glob
+import time
 import os
 import re
 
@@ -31,11 +42,16 @@ def exec_target_identification(entry): # Step 2
     entry["target_identification"]["explanation"] = output["explanation"]
     entry["target_identification"]["conversation_history"] = os.path.join(os.getcwd(), output["saved_path"])
 
-def exec_nsvs(entry, sample_rate, device, model_name): # Step 3
+def read_videos(video_paths, sample_rate):
     multi_video_data = []
-    for video_path in entry["video_paths"]:
+    for video_path in video_paths:
         reader = Mp4Reader(path=video_path, sample_rate=sample_rate)
         multi_video_data.append(reader.read_video())
+    return multi_video_data
+
+def exec_nsvs(entry, sample_rate, device, model_name, vlm=None, multi_video_data=None, detection_memo=None): # Step 3
+    if multi_video_data is None:
+        multi_video_data = read_videos(entry["video_paths"], sample_rate)
 
     fps = set([video_data["video_info"]["fps"] for video_data in multi_video_data])
     frame_count = set([video_data["video_info"]["frame_count"] for video_data in multi_video_data])
@@ -54,23 +70,27 @@ def exec_nsvs(entry, sample_rate, device, model_name): # Step 3
             ]
             raise ValueError(" ; ".join(filter(None, errors)))
 
-        output, indices = run_nsvs(
+        output, indices, vlm_metrics = run_nsvs(
             multi_video_data,
             entry["video_paths"],
             entry["puls"]["proposition"],
             entry["puls"]["specification"],
             device=device,
             model_name=model_name,
+            vlm=vlm,
+            detection_memo=detection_memo,
         )
     except Exception as e:
         entry["metadata"]["error"] = repr(e)
         print(repr(e))
         output = {-1: {}}
         indices = []
+        vlm_metrics = {}
     
     entry["nsvs"] = {}
     entry["nsvs"]["output"] = output
     entry["nsvs"]["indices"] = [list(idx) for idx in indices]
+    entry["nsvs"]["vlm_metrics"] = vlm_metrics
 
 def exec_merge(entry): # Step 4
     inner = entry["target_identification"]["frame_window"].strip()[1:-1]
@@ -109,36 +129,235 @@ def exec_merge(entry): # Step 4
     else:
         entry["frames_of_interest"] = {-1: {}}
 
-def run_orbit(output_dir, device_number, current_split, total_splits):
+def run_work_queue(path, worker_id, takes, submit_take, max_in_flight, poll_interval=30.0, checkpoint=None, is_done=None):
+    """Claim takes from the shared queue and run them until no take is pending or leased anywhere.
+
+    Questions for which `is_done(index)` holds (finished by an earlier attempt at the take) are not
+    run again, and `checkpoint` is fsynced before a take is marked complete, so whoever compacts
+    once the queue drains reads every finished entry.
+    """
+    queue = WorkQueue(path)
+    queue.enqueue([(video_paths[0], list(video_paths)) for video_paths in takes]) # first worker fills it, later ones are no-ops
+    keeper = LeaseKeeper(queue, worker_id)
+    in_flight = {}
+    try:
+        while True:
+            while len(in_flight) < max_in_flight:
+                claimed = queue.claim(worker_id)
+                if claimed is None:
+                    break
+                key, video_paths = claimed
+                indices = [i for i in takes.get(tuple(video_paths), []) if is_done is None or not is_done(i)]
+                if not indices: # finished (checkpointed) earlier by some worker
+                    queue.complete(worker_id, key)
+                    continue
+                keeper.add(key)
+                in_flight[submit_take(video_paths, indices)] = key
+
+            if not in_flight:
+                if queue.unfinished() == 0:
+                    break
+                time.sleep(poll_interval) # other workers hold the rest; wait in case their leases expire
+                continue
+
+            done, _ = wait(list(in_flight), timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = in_flight.pop(future)
+                keeper.remove(key)
+                if checkpoint is not None:
+                    checkpoint.sync() # also before fail, so a reclaiming worker sees the questions that did finish
+                if future.exception() is None:
+                    queue.complete(worker_id, key)
+                else:
+                    print(f"Take {key} failed: {future.exception()!r}")
+                    queue.fail(worker_id, key, repr(future.exception()))
+    finally:
+        keeper.close()
+    print(f"Work queue {path}: {queue.counts()}")
+
+def run_orbit(output_dir, device_number, current_split=1, total_splits=1, api_bases=None, llm_workers=8, decode_workers=2, vlm_workers=2, max_decoded_takes=4, work_queue=None, worker_id=None, trace_path=None):
+    """Run the ORBIT pipeline over one split, or over whatever a shared work queue hands out.
+
+    Entries flow through per-stage pools (LLM: PULS and target identification, decode, VLM: NSVS
+    and merge), so LLM latency, decoding and detection overlap across entries. Questions on the
+    same take share one decode and one detection memo and run their VLM stage one after another;
+    at most `max_decoded_takes` decoded takes are held in memory. A question that fails is reported
+    and left out of the output (a rerun retries it) without holding up the rest of its take.
+
+    Finished entries are checkpointed to <output>_checkpoint.jsonl keyed by video_id and a hash of
+    the run config; a restarted run skips them, and the final JSON is compacted from the checkpoint.
+
+    With `work_queue` (a SQLite path shared by every worker process), the static split is ignored:
+    each worker claims takes one at a time under a heartbeated lease, writes its own checkpoint,
+    and takes of workers that died are reclaimed once their lease expires. The worker that sees
+    the queue drained (elected through the queue) compacts every worker's checkpoint into
+    `output_dir`.
+
+    `trace_path` (or ORBIT_TRACE) records timing spans per entry and take (.json: Chrome trace,
+    otherwise JSONL); scripts/trace_summary.py turns them into per-entry stage breakdowns.
+    The decode, language and detect stages can be sampled with orbit.utils.profiling
+    (ORBIT_PROFILE or --profile); entry ranges index into the loaded dataset. A detect profile
+    includes the VLM router's pool threads while they work for that entry; other entries'
+    concurrent requests are not mixed in.
+    """
+    if trace_path:
+        tracing.configure(trace_path)
     loader = EgoExo4D()
     data = loader.load_data()
-    
-    output = []
+    model_name = "OpenGVLab/InternVL3_5-14B"
+
+    # with api_bases every split shares all listed servers instead of only http://localhost:800{device_number}
+    vlm = VLLMRouter(api_bases, model=model_name) if api_bases else None
 
-    starting = (len(data) * (current_split-1)) // total_splits
-    ending = (len(data) * current_split) // total_splits
+    run_metrics = VLMMetrics()
+
+    if work_queue:
+        starting, ending = 0, len(data)
+        worker_id = worker_id or default_worker_id()
+        checkpoint_path = f"{os.path.splitext(output_dir)[0]}_checkpoint_{worker_id}.jsonl"
+    else:
+        starting = (len(data) * (current_split-1)) // total_splits
+        ending = (len(data) * current_split) // total_splits
+        checkpoint_path = f"{os.path.splitext(output_dir)[0]}_checkpoint.jsonl"
+    checkpoint_paths = sorted(glob.glob(f"{glob.escape(os.path.splitext(output_dir)[0])}_checkpoint*.jsonl")) if work_queue else [checkpoint_path]
+
+    # resume: entries finished under the same config are taken from the checkpoint
+    config = config_hash({"model_name": model_name, "sample_rate": 1})
+    checkpoint = JsonlCheckpoint(checkpoint_path, config)
+    completed = load_checkpoints(checkpoint_paths, config)
+    num_done = 0
     for i in range(starting, ending):
+        if data[i]["video_id"] in completed:
+            if not work_queue: # with a queue, each worker reports only what it ran
+                run_metrics.merge(completed[data[i]["video_id"]].get("nsvs", {}).get("vlm_metrics", {}))
+            num_done += 1
+    print(f"Resuming: {num_done}/{ending - starting} entries already done")
+
+    # questions on the same take share one decode and one detection memo
+    takes = {}
+    for i in range(starting, ending):
+        if data[i]["video_id"] not in completed:
+            takes.setdefault(tuple(data[i]["video_paths"]), []).append(i)
+
+    scheduler = StageScheduler({"llm": llm_workers, "decode": decode_workers, "vlm": vlm_workers})
+    decoded_slots = threading.Semaphore(max_decoded_takes)
+
+    def decode(video_paths, i):
+        decoded_slots.acquire() # released once the take's last question is done
+        with (
+            tracing.context(take=video_paths[0]),
+            tracing.span("decode_stage"),
+            profiling.stage("decode", entry=data[i]["video_id"], index=i),
+        ):
+            return read_videos(video_paths, sample_rate=1)
+
+    def language(i): # Steps 1-2
         print("\n" + "*"*50 + f" {i}/{len(data)-1} " + "*"*50)
+        with (
+            tracing.context(entry=data[i]["video_id"], take=data[i]["video_paths"][0]),
+            tracing.span("language_stage"),
+            profiling.stage("language", entry=data[i]["video_id"], index=i),
+        ):
+            exec_puls(data[i])
+            exec_target_identification(data[i])
+
+    def detect(i, decoded, detection_memo): # Steps 3-4
         entry = data[i]
-        exec_puls(entry)
-        exec_target_identification(entry)
-        exec_nsvs(entry, sample_rate=1, device=device_number, model_name="OpenGVLab/InternVL3_5-14B")
-        exec_merge(entry)
-        output.append(entry)
+        with (
+            tracing.context(entry=entry["video_id"], take=entry["video_paths"][0]),
+            tracing.span("detect_stage"),
+            profiling.stage("detect", entry=entry["video_id"], index=i),
+        ):
+            exec_nsvs(entry, sample_rate=1, device=device_number, model_name=model_name, vlm=vlm, multi_video_data=decoded.result(), detection_memo=detection_memo)
+            exec_merge(entry)
+        run_metrics.merge(entry["nsvs"]["vlm_metrics"])
+        checkpoint.append(entry["video_id"], entry) # results as they complete, in completion order
+        return entry
+
+    failed = []
 
-    with open(output_dir, "w") as f:
-        json.dump(output, f, indent=4)
+    def submit_take(video_paths, indices):
+        """Schedule every question of one take; returns a future that fails if any question did"""
+        decoded = scheduler.submit("decode", decode, list(video_paths), indices[0]) # profiled as the take's first entry
+        detection_memo = {}
+        questions = []
+        for i in indices:
+            language_done = scheduler.submit("llm", language, i)
+            # in order after the previous question, whether or not it succeeded
+            questions.append(scheduler.submit("vlm", detect, i, decoded, detection_memo, after=[decoded, language_done], settled=questions[-1:]))
+        take_done = Future()
+
+        def on_last_question(_):
+            decoded_slots.release()
+            errors = []
+            for i, question in zip(indices, questions):
+                if question.exception() is not None:
+                    print(f"Error on {data[i]['video_id']}: {question.exception()!r}")
+                    failed.append(data[i]["video_id"])
+                    errors.append(question.exception())
+            if errors:
+                take_done.set_exception(errors[0])
+            else:
+                take_done.set_result(None)
+        questions[-1].add_done_callback(on_last_question)
+        return take_done
+
+    try:
+        if work_queue:
+            finished = CheckpointKeys(f"{glob.escape(os.path.splitext(output_dir)[0])}_checkpoint*.jsonl", config)
+            run_work_queue(
+                work_queue, worker_id, takes, submit_take, max_in_flight=max_decoded_takes,
+                checkpoint=checkpoint, is_done=lambda i: data[i]["video_id"] in finished.refresh(),
+            )
+        else:
+            wait([submit_take(video_paths, indices) for video_paths, indices in takes.items()])
+    finally:
+        scheduler.shutdown(wait=True) # nothing may append to the checkpoint once it is closed
+        checkpoint.close()
+    if failed:
+        print(f"{len(failed)} entries failed and are missing from the output: {failed}")
+
+    keys = [data[i]["video_id"] for i in range(starting, ending)]
+    if not work_queue:
+        checkpoint.compact(output_dir, keys)
+    else:
+        queue = WorkQueue(work_queue)
+        counts = queue.counts()
+        # one worker compacts once the queue is drained; a later run that finishes more items elects again
+        if queue.unfinished() == 0 and queue.elect(f"compact:{config}:{counts.get('done', 0)}", worker_id):
+            checkpoint_paths = sorted(glob.glob(f"{glob.escape(os.path.splitext(output_dir)[0])}_checkpoint*.jsonl"))
+            compact_checkpoints(checkpoint_paths, config, output_dir, keys)
+
+    counters = run_metrics.to_dict()["counters"]
+    memo_hits = counters.get("memo_hits", 0)
+    if counters["requests"] + memo_hits:
+        print(f"Detection dedup: {memo_hits}/{counters['requests'] + memo_hits} detections reused across questions ({memo_hits / (counters['requests'] + memo_hits):.1%}) over {len(takes)} takes")
+
+    run_metrics.dump(f"{os.path.splitext(output_dir)[0]}_vlm_metrics.json")
+    if vlm is not None:
+        print(json.dumps(vlm.stats(), indent=4))
+        vlm.close()
 
 def postprocess(output_dir):
     loader = EgoExo4D()
     loader.postprocess_data(output_dir)
 
 def main():
+    parser = argparse.ArgumentParser(description="Run the ORBIT pipeline")
+    profiling.add_arguments(parser) # e.g. --profile detect --profile-entries 10:20
+    profiling.configure_from_args(parser.parse_args())
+
     # current_split = 3
     # total_splits = 3
     # device_number = current_split
     # output_dir = f"/nas/mars/experiment_result/orbit/2_full_output/ego_exo4d_{current_split}.json"
     # run_orbit(output_dir, device_number, current_split, total_splits)
+    # api_bases = [f"http://localhost:800{i}/v1" for i in range(4)]
+    # run_orbit(output_dir, device_number, current_split, total_splits, api_bases=api_bases)
+    # one process per GPU, all pulling from the same queue instead of fixed splits:
+    # run_orbit(output_dir, device_number, work_queue=f"{os.path.splitext(output_dir)[0]}_queue.sqlite")
+    # per-entry timing spans, then: python scripts/trace_summary.py <output>_trace.jsonl
+    # run_orbit(output_dir, device_number, current_split, total_splits, trace_path=f"{os.path.splitext(output_dir)[0]}_trace.jsonl")
 
     orbit_dir = f"/nas/mars/experiment_result/orbit/2_full_output/ego_exo4d.json"
     postprocess(orbit_dir)
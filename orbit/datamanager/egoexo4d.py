@@ -1,9 +1,11 @@
 from orbit.datamanager.manager import Manager
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from collections import defaultdict
 from tqdm import tqdm
 import hashlib
 import shutil
+import time
 import json
 import copy
 import os
@@ -34,13 +36,82 @@ class EgoExo4D(Manager):
         return ret
 
 
-    def postprocess_data(self, output_dir):
+    def postprocess_data(self, output_dir, num_workers=8, manifest_every=50, manifest_interval=30.0):
+        """Crop every changed entry; the manifest is saved every `manifest_every` entries or
+        `manifest_interval` seconds and at the end, so an interrupted run redoes at most that batch"""
         with open(output_dir, "r") as f:
             data = json.load(f)
         os.makedirs(self._cropped_output_video_path, exist_ok=True)
 
-        for entry in tqdm(data, desc="Processing videos"):
+        manifest_path = os.path.join(self._cropped_output_video_path, "manifest.json")
+        manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+
+        jobs = {}
+        for entry in data:
             save_path = os.path.join(self._cropped_output_video_path, f"{entry['video_id']}.mp4")
-            self.crop_video(entry, save_path)
+            entry_hash = self._entry_hash(entry)
+            record = manifest.get(entry["video_id"])
+            if isinstance(record, dict) and record["hash"] == entry_hash and (record["output"] is None or os.path.exists(record["output"])):
+                continue
+            jobs[entry["video_id"]] = (entry, save_path, entry_hash)
+        print(f"Skipping {len(data) - len(jobs)}/{len(data)} unchanged entries")
+
+        unsaved, last_save = 0, time.monotonic()
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = {
+                executor.submit(self._crop_entry, entry, save_path): video_id
+                for video_id, (entry, save_path, _) in jobs.items()
+            }
+            try:
+                for future in tqdm(as_completed(futures), total=len(futures), desc="Processing videos"):
+                    video_id = futures[future]
+                    try:
+                        written = future.result()
+                    except Exception as e:
+                        print(f"Error cropping {video_id}: {e!r}")
+                        continue
+                    _, save_path, entry_hash = jobs[video_id]
+                    # "output": None records that this entry has nothing to crop, not that it was cropped
+                    manifest[video_id] = {"hash": entry_hash, "output": save_path if written else None}
+                    unsaved += 1
+                    if unsaved >= manifest_every or time.monotonic() - last_save >= manifest_interval:
+                        self._write_json_atomic(manifest, manifest_path)
+                        unsaved, last_save = 0, time.monotonic()
+            finally:
+                if unsaved:
+                    self._write_json_atomic(manifest, manifest_path)
+
+    def _entry_hash(self, entry):
+        """Hash everything the cropped output depends on: FOI, input paths, their mtimes and the crop settings"""
+        mtimes = [os.path.getmtime(p) if os.path.exists(p) else None for p in entry["video_paths"]]
+        key = {
+            "frames_of_interest": entry.get("frames_of_interest"),
+            "nsvs_output": entry.get("nsvs", {}).get("output"),
+            "video_paths": entry["video_paths"],
+            "mtimes": mtimes,
+            "crop_settings": self.crop_settings(),
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode("utf-8")).hexdigest()
 
+    def _crop_entry(self, entry, save_path):
+        """Crop entry to save_path; False (and no stale crop left at save_path) when there is no output"""
+        # write next to the target and rename, so an interrupted run never leaves a truncated crop behind
+        tmp_path = f"{save_path[:-len('.mp4')]}.partial.mp4"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        self.crop_video(entry, tmp_path)
+        if not os.path.exists(tmp_path):
+            if os.path.exists(save_path):
+                os.remove(save_path) # an earlier crop of this entry no longer matches its frames of interest
+            return False
+        os.replace(tmp_path, save_path)
+        return True
 
+    def _write_json_atomic(self, obj, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(obj, f, indent=4)
+        os.replace(tmp_path, path)
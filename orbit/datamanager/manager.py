@@ -3,9 +3,61 @@ import subprocess
 import json
 import cv2
 import numpy as np
+import tempfile
+import shutil
 import os
 
+from orbit.utils import tracing
+
+def stitch_grid(frames_to_stitch, labels, width, height):
+    """Tile labeled camera frames into a single width x height grid"""
+    num_frames_to_stitch = len(frames_to_stitch)
+
+    if num_frames_to_stitch == 1:
+        rows, cols = 1, 1
+    elif num_frames_to_stitch == 2:
+        rows, cols = 2, 1
+    else:
+        rows = 2
+        cols = (num_frames_to_stitch + 1) // 2
+
+    new_width = width // cols
+    new_height = height // rows
+
+    resized_frames = []
+    for frame in frames_to_stitch:
+        resized_frames.append(cv2.resize(frame, (new_width, new_height)))
+
+    labeled_frames = []
+    for frame, label in zip(resized_frames, labels):
+        labeled_frame = frame.copy()
+        cv2.putText(labeled_frame, label, (5, 15), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 1)
+        labeled_frames.append(labeled_frame)
+
+    num_missing = rows * cols - num_frames_to_stitch
+    for _ in range(num_missing):
+        labeled_frames.append(np.zeros((new_height, new_width, 3), dtype=np.uint8))
+
+    grid_rows = []
+    for i in range(rows):
+        start_index = i * cols
+        end_index = start_index + cols
+        grid_rows.append(cv2.hconcat(labeled_frames[start_index:end_index]))
+
+    stitched_frame = cv2.vconcat(grid_rows)
+
+    stitched_h, stitched_w, _ = stitched_frame.shape
+    if stitched_h != height or stitched_w != width:
+        stitched_frame = cv2.resize(stitched_frame, (width, height))
+    return stitched_frame
+
 class Manager(ABC):
+    # Opt in to cutting crops whose frames all come from one source video with ffmpeg instead of
+    # re-encoding. Those crops keep the source codec, have no camera label drawn on them, and each
+    # span may start up to one keyframe interval early, which VQA then samples too.
+    stream_copy = False
+    crop_fourcc = "mp4v" # codec of re-encoded crops
+
     @abstractmethod
     def load_data(self) -> list:
         pass
@@ -14,10 +66,22 @@ class Manager(ABC):
     def postprocess_data(self, output_dir):
         pass
 
+    def crop_settings(self) -> dict:
+        """Everything besides the entry itself that changes what crop_video writes"""
+        return {"stream_copy": self.stream_copy, "fourcc": self.crop_fourcc}
+
     def crop_video(self, entry, save_path):
         if entry.get("nsvs", {}).get("output") == [-1] or len(entry["video_paths"]) == 0:
             return
 
+        with tracing.span("crop_video", entry=entry.get("video_id")) as span:
+            span.set(stream_copy=self._crop_video(entry, save_path))
+
+    def _crop_video(self, entry, save_path):
+        """Returns whether the crop was a stream copy"""
+        if self.stream_copy and self._stream_copy_crop(entry, save_path):
+            return True
+
         caps = {}
         video_paths = {}
         for path in entry["video_paths"]:
@@ -32,7 +96,7 @@ class Manager(ABC):
         if fps == 0:
             fps = 30
 
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        fourcc = cv2.VideoWriter_fourcc(*self.crop_fourcc)
         writer = cv2.VideoWriter(save_path, fourcc, fps, (width, height))
 
         sorted_frame_nums = sorted([int(f) for f in entry["frames_of_interest"].keys()])
@@ -54,50 +118,111 @@ class Manager(ABC):
 
             if not frames_to_stitch:
                 continue
-            
-            num_frames_to_stitch = len(frames_to_stitch)
-
-            if num_frames_to_stitch == 1:
-                rows, cols = 1, 1
-            elif num_frames_to_stitch == 2:
-                rows, cols = 2, 1
-            else:
-                rows = 2
-                cols = (num_frames_to_stitch + 1) // 2
-
-            new_width = width // cols
-            new_height = height // rows
-
-            resized_frames = []
-            for frame in frames_to_stitch:
-                resized_frames.append(cv2.resize(frame, (new_width, new_height)))
-
-            labeled_frames = []
-            for frame, label in zip(resized_frames, labels):
-                labeled_frame = frame.copy()
-                cv2.putText(labeled_frame, label, (5, 15), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 1)
-                labeled_frames.append(labeled_frame)
-
-            num_missing = rows * cols - num_frames_to_stitch
-            for _ in range(num_missing):
-                labeled_frames.append(np.zeros((new_height, new_width, 3), dtype=np.uint8))
-
-            grid_rows = []
-            for i in range(rows):
-                start_index = i * cols
-                end_index = start_index + cols
-                grid_rows.append(cv2.hconcat(labeled_frames[start_index:end_index]))
-            
-            stitched_frame = cv2.vconcat(grid_rows)
-
-            stitched_h, stitched_w, _ = stitched_frame.shape
-            if stitched_h != height or stitched_w != width:
-                 stitched_frame = cv2.resize(stitched_frame, (width, height))
 
+            stitched_frame = stitch_grid(frames_to_stitch, labels, width, height)
             writer.write(stitched_frame)
 
         for cap in caps.values():
             cap.release()
         writer.release()
+        return False
+
+    def _single_camera_spans(self, entry):
+        """Group frames of interest into contiguous runs, or None if any frame needs a multi-camera grid"""
+        video_paths = {os.path.basename(path).split('.')[0]: path for path in entry["video_paths"]}
 
+        spans = [] # [start_frame, end_frame, video_path], end inclusive
+        for frame_num in sorted(int(f) for f in entry["frames_of_interest"].keys()):
+            cams = [cam for cam in entry["frames_of_interest"][str(frame_num)] if cam in video_paths]
+            if not cams:
+                continue
+            if len(cams) > 1:
+                return None
+            path = video_paths[cams[0]]
+            if spans and spans[-1][2] == path and spans[-1][1] == frame_num - 1:
+                spans[-1][1] = frame_num
+            else:
+                spans.append([frame_num, frame_num, path])
+        return spans
+
+    def _keyframe_times(self, video_path):
+        # packet flags come from the container index, so nothing is decoded
+        cmd = [
+            "ffprobe", "-v", "error", "-select_streams", "v:0",
+            "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", video_path
+        ]
+        output = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+        times = []
+        for line in output.split():
+            pts_time, _, flags = line.partition(',')
+            if "K" in flags and pts_time not in ("", "N/A"):
+                times.append(float(pts_time))
+        return sorted(times)
+
+    def _stream_copy_crop(self, entry, save_path):
+        """Cut spans of one source video without decoding; returns False when the re-encode path is needed"""
+        if shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None:
+            return False
+        spans = self._single_camera_spans(entry)
+        if not spans:
+            return False
+        if len({path for _, _, path in spans}) > 1:
+            return False # cameras may differ in resolution and codec, which -c copy cannot concatenate
+
+        cap = cv2.VideoCapture(spans[0][2])
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        cap.release()
+        if fps == 0:
+            fps = 30
 
+        # crop_video sizes its output after the entry's first camera; copying can't resize
+        cap = cv2.VideoCapture(entry["video_paths"][0])
+        first_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        cap.release()
+        if size != first_size:
+            return False
+
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(save_path)))
+        try:
+            keyframes = {}
+            segment_paths = []
+            previous_end = None
+            for i, (start_frame, end_frame, path) in enumerate(spans):
+                if path not in keyframes:
+                    keyframes[path] = self._keyframe_times(path)
+                start = start_frame / fps
+                end = (end_frame + 1) / fps
+
+                # stream copy can only start on a keyframe, so snap back to the one at or before the span
+                earlier = [t for t in keyframes[path] if t <= start + 1e-6]
+                start = earlier[-1] if earlier else 0.0
+                if previous_end is not None and start < previous_end - 1e-6:
+                    # the pre-roll would repeat frames of the previous span; only re-encoding can cut there
+                    return False
+                previous_end = end
+
+                segment_path = os.path.join(tmp_dir, f"{i:05d}.mp4")
+                cmd = [
+                    "ffmpeg", "-v", "error", "-y", "-ss", f"{start:.6f}", "-i", path,
+                    "-t", f"{end - start:.6f}", "-map", "0:v:0", "-c", "copy",
+                    "-avoid_negative_ts", "make_zero", segment_path
+                ]
+                subprocess.run(cmd, check=True)
+                segment_paths.append(segment_path)
+
+            list_path = os.path.join(tmp_dir, "segments.txt")
+            with open(list_path, "w") as f:
+                for segment_path in segment_paths:
+                    f.write(f"file '{segment_path}'\n")
+            cmd = [
+                "ffmpeg", "-v", "error", "-y", "-f", "concat", "-safe", "0",
+                "-i", list_path, "-c", "copy", save_path
+            ]
+            subprocess.run(cmd, check=True)
+        except (subprocess.CalledProcessError, OSError, ValueError) as e:
+            print(f"Stream copy failed for {save_path}, re-encoding instead: {e!r}")
+            return False
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return True
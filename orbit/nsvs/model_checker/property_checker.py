@@ -1,5 +1,6 @@
 from orbit.nsvs.model_checker.frame_validator import FrameValidator
 from orbit.nsvs.model_checker.stormpy import StormModelChecker
+from orbit.utils import tracing
 
 
 class PropertyChecker:
@@ -23,14 +24,18 @@ class PropertyChecker:
         return f"P>={self.tl_satisfaction_threshold:.2f} [ {specification_raw} ]"
 
     def validate_frame(self, frame_of_interest):
-        return self.frame_validator.validate_frame(frame_of_interest)
+        with tracing.span("validate_frame", window=frame_of_interest.frame_idx):
+            return self.frame_validator.validate_frame(frame_of_interest)
 
     def check_automaton(self, automaton):
-        return self.model_checker.check_automaton(
-            transitions=automaton.transitions,
-            states=automaton.states,
-            model_type=self.model_type
-        )
+        with tracing.span("check_automaton") as span:
+            if tracing.enabled():
+                span.set(states=len(automaton.states))
+            return self.model_checker.check_automaton(
+                transitions=automaton.transitions,
+                states=automaton.states,
+                model_type=self.model_type
+            )
 
     def validate_tl_specification(self, specification):
         return self.model_checker.validate_tl_specification(specification)
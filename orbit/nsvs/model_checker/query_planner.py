@@ -0,0 +1,55 @@
+import itertools
+
+from orbit.nsvs.model_checker.frame_validator import FrameValidator, SymbolicFilterRule
+from orbit.nsvs.video.video_frame import VideoFrame
+from orbit.nsvs.vlm.obj import DetectedObject
+
+
+class QueryPlanner:
+    """Orders a window's proposition queries so that FrameValidator can reject it early.
+
+    A window that fails FrameValidator never reaches the automaton, so its remaining propositions
+    cannot change the verdict; a window that passes needs every proposition. Propositions are
+    queried in stages (NOT props, then OR props, then the rest) and querying stops once the window
+    fails validation whatever the unqueried propositions turn out to be.
+    """
+    MAX_UNKNOWN = 8 # 3^8 validator calls; beyond that, always query everything
+
+    def __init__(self, frame_validator: FrameValidator, proposition: list[str]):
+        self.frame_validator = frame_validator
+        self.proposition = proposition
+        self.threshold = frame_validator.threshold_of_probability
+
+        rule = frame_validator.symbolic_verification_rule
+        not_props = rule.get(SymbolicFilterRule.NOT_PROPS)
+        or_props = [prop for group in rule.get(SymbolicFilterRule.OR_PROPS) or [] for prop in group]
+        not_stage = [prop for prop in proposition if not_props and prop in not_props] # same containment test as symbolic_verification
+        or_stage = [prop for prop in proposition if prop in or_props and prop not in not_stage]
+        rest = [prop for prop in proposition if prop not in not_stage and prop not in or_stage]
+        self.stages = [stage for stage in (not_stage, or_stage, rest) if stage]
+
+    def _representatives(self, prop: str) -> list[tuple]:
+        # the validator only compares probabilities with the threshold (> and >=): below, at and above it
+        return [
+            (None, DetectedObject(name=prop, is_detected=False, confidence=0.0, probability=0.0)),
+            (None, DetectedObject(name=prop, is_detected=True, confidence=self.threshold, probability=self.threshold)),
+            (None, DetectedObject(name=prop, is_detected=True, confidence=1.0, probability=1.0)),
+        ]
+
+    def is_rejected(self, known: dict) -> bool:
+        """True if the window fails validation for every outcome of the propositions not in `known`"""
+        unknown = [prop for prop in self.proposition if prop not in known]
+        if not unknown:
+            return False # fully known; the caller validates it as usual
+        if len(unknown) > self.MAX_UNKNOWN:
+            return False
+        for outcome in itertools.product(*(self._representatives(prop) for prop in unknown)):
+            object_of_interest = dict(known)
+            object_of_interest.update(zip(unknown, outcome))
+            frame = VideoFrame(frame_idx=-1, frame_images=None, object_of_interest={prop: object_of_interest[prop] for prop in self.proposition})
+            try:
+                if self.frame_validator.validate_frame(frame):
+                    return False
+            except KeyError: # spec names a proposition outside the set; let the real validation decide
+                return False
+        return True
@@ -5,11 +5,17 @@ import tqdm
 import os
 
 from orbit.nsvs.model_checker.property_checker import PropertyChecker
+from orbit.nsvs.model_checker.query_planner import QueryPlanner
 from orbit.nsvs.model_checker.video_automaton import VideoAutomaton
 from orbit.nsvs.video.frames_of_interest import FramesofInterest
 from orbit.utils.intersection import intersection_with_gaps
+from orbit.nsvs.video.scene_change import evenly_spaced, frame_signature, scene_windows, window_distance
 from orbit.nsvs.video.video_frame import VideoFrame
-from orbit.nsvs.vlm.vllm_client import VLLMClient
+from orbit.nsvs.vlm.prefilter import ObjectPrefilter
+from orbit.nsvs.vlm.metrics import VLMMetrics
+from orbit.nsvs.vlm.router import VLLMRouter
+from orbit.nsvs.vlm.vllm_client import CAMERA_LETTERS
+from orbit.utils import tracing
 
 
 PRINT_ALL = False
@@ -17,6 +23,9 @@ warnings.filterwarnings("ignore")
 
 from orbit.nsvs.vlm.obj import DetectedObject
 
+def normalize_proposition(prop: str) -> str:
+    return " ".join(prop.replace("_", " ").lower().split())
+
 def run_nsvs(
     multi_video_data: list,
     video_paths: list,
@@ -29,101 +38,343 @@ def run_nsvs(
     tl_satisfaction_threshold: float = 0.6,
     detection_threshold: float = 0.5,
     vlm_detection_threshold: float = 0.349,
-    image_output_dir: str = "outputs"
+    image_output_dir: str = "outputs",
+    vlm: VLLMRouter | None = None,
+    frame_mosaic: bool = False,
+    camera_mosaic: bool = False,
+    camera_mosaic_band: tuple[float, float] = (0.2, 0.8),
+    adaptive_cameras: bool = False,
+    camera_fanout_threshold: float = 0.5,
+    camera_sweep_interval: int = 10,
+    coarse_stride: int = 1,
+    coarse_margin: float = 0.15,
+    lazy_propositions: bool = False,
+    reuse_unchanged: bool = False,
+    scene_change_threshold: float = 0.02,
+    max_reuse_streak: int = 5,
+    adaptive_windows: bool = False,
+    window_change_threshold: float = 0.08,
+    max_window_len: int | None = None,
+    prefilter: ObjectPrefilter | None = None,
+    detection_memo: dict | None = None
 ):
-    """Find relevant frames from a video that satisfy a specification"""
+    """Find relevant frames from a video that satisfy a specification
+
+    With `camera_mosaic`, each proposition is first asked once over a mosaic of all cameras, and only
+    answers whose confidence falls inside `camera_mosaic_band` are re-asked per camera. Windows with
+    more cameras than a mosaic can label (8) are asked per camera.
+
+    With `adaptive_cameras`, a proposition is first asked only on the camera that won it in the
+    previous window; the other cameras are asked when that confidence is below
+    `camera_fanout_threshold`, and every `camera_sweep_interval`-th window asks all cameras.
+
+    With `coarse_stride` > 1, only every `coarse_stride`-th window is queried first; windows within a
+    stride of a coarse window that passes FrameValidator, or has a proposition probability within
+    `coarse_margin` of `detection_threshold`, are then queried too. Windows never queried count as
+    windows that failed validation.
+
+    With `lazy_propositions`, a window's propositions are asked in QueryPlanner stages and the rest
+    are skipped once the window is certain to fail FrameValidator; accepted windows are unchanged.
+    Skipped propositions carry a placeholder probability and don't count towards `coarse_margin`.
+
+    With `reuse_unchanged`, a window whose frames differ from the last queried window (the one right
+    before it) by less than `scene_change_threshold` reuses that window's detections instead of
+    querying, at most `max_reuse_streak` windows in a row.
+
+    With `adaptive_windows`, windows end where the sampled frames change by `window_change_threshold`
+    or more (at least `num_of_frame_in_sequence` frames each) and grow up to `max_window_len` frames
+    (default 4x) in static stretches; each request still sends `num_of_frame_in_sequence` frames
+    spread over its window.
+
+    With a `prefilter`, propositions whose objects the local detector does not see anywhere in a
+    window are answered as not detected without a VLM query (in audit mode they are still queried).
+
+    `detection_memo` is shared by entries on the same videos: detections are stored under
+    (window bounds, camera, normalized proposition) and reused instead of queried again.
+
+    Returns the frames of interest, the per-split detections and this entry's VLM request metrics.
+    """
 
     if PRINT_ALL:
         print(f"\nPropositions: {proposition}")
         print(f"Specification: {specification}")
         print(f"Video path: {video_paths}\n")
 
-    vlm = VLLMClient(model=model_name, api_base=f"http://localhost:800{device}/v1")
+    owns_vlm = vlm is None
+    if not owns_vlm and any(endpoint.client.mosaic != frame_mosaic for endpoint in vlm.endpoints):
+        # a passed-in router decides the request format; don't let frame_mosaic be silently ignored
+        raise ValueError(f"frame_mosaic={frame_mosaic} does not match the passed vlm; build it with VLLMRouter(..., mosaic={frame_mosaic})")
+    if owns_vlm: # single-endpoint router, so detects still get retries and deadlines
+        vlm = VLLMRouter([f"http://localhost:800{device}/v1"], model=model_name, health_check_interval=0, mosaic=frame_mosaic)
 
-    automaton = VideoAutomaton(include_initial_state=True)
-    automaton.set_up(proposition_set=proposition)
+    try:
+        metrics = VLMMetrics()
 
-    checker = PropertyChecker(
-        proposition=proposition,
-        specification=specification,
-        model_type=model_type,
-        tl_satisfaction_threshold=tl_satisfaction_threshold,
-        detection_threshold=detection_threshold
-    )
+        automaton = VideoAutomaton(include_initial_state=True)
+        automaton.set_up(proposition_set=proposition)
 
-    frame_step = int(round(multi_video_data[0]["video_info"]["fps"] / multi_video_data[0]["sample_rate"])) # since they are identical, take from [0]
-    frame_of_interest = FramesofInterest(num_of_frame_in_sequence, frame_step)
+        checker = PropertyChecker(
+            proposition=proposition,
+            specification=specification,
+            model_type=model_type,
+            tl_satisfaction_threshold=tl_satisfaction_threshold,
+            detection_threshold=detection_threshold
+        )
 
-    multi_frames = [video_data["images"] for video_data in multi_video_data]
+        frame_step = int(round(multi_video_data[0]["video_info"]["fps"] / multi_video_data[0]["sample_rate"])) # since they are identical, take from [0]
+        multi_frames = [video_data["images"] for video_data in multi_video_data]
 
-    frame_windows = []
-    for i in range(0, len(multi_frames[0]), num_of_frame_in_sequence): # these are established to be the same length
-        frame_windows.append([frames[i : i + num_of_frame_in_sequence] for frames in multi_frames])
-    if PRINT_ALL:
-        print(f"{len(frame_windows)} frame windows to process")
-        print(f"{len(frame_windows[0])} cameras per frame window")
-        print(f"{len(frame_windows[0][0])} frames per camera per window")
-        print(f"{frame_windows[0][0][0].shape} shape of each frame")
-
-    def process_frame(multi_sequence_of_frames: list[list[np.ndarray]], frame_count: int):
-        object_of_interest = {}
-        frame_images = {f"cam{i}": seq for i, seq in enumerate(multi_sequence_of_frames)}
-
-        for prop in proposition:
-            best_detection = (None, DetectedObject(name=prop, is_detected=False, confidence=0.0, probability=0.0))
-
-            for cam_id, sequence_of_frames in frame_images.items():
-                detected_object = vlm.detect(
-                    seq_of_frames=sequence_of_frames,
-                    scene_description=prop,
-                    threshold=vlm_detection_threshold
-                )
-                if detected_object.confidence > best_detection[1].confidence:
-                    best_detection = (cam_id, detected_object)
-
-            object_of_interest[prop] = best_detection
-            if PRINT_ALL and best_detection[1].is_detected:
-                print(f"\t{prop} ({best_detection[0]}): {best_detection[1].confidence}->{best_detection[1].probability}")
-
-        # print(frame_images.keys(), len(frame_images.values()))
-        # print(object_of_interest)
-        frame = VideoFrame(
-            frame_idx=frame_count,
-            frame_images=frame_images,
-            object_of_interest=object_of_interest,
-        )
-        return frame
+        multi_signatures = []
+        if reuse_unchanged or adaptive_windows:
+            multi_signatures = [
+                video_data.get("signatures") or [frame_signature(image) for image in video_data["images"]]
+                for video_data in multi_video_data
+            ]
 
-    if PRINT_ALL:
-        looper = enumerate(frame_windows)
-    else:
-        looper = tqdm.tqdm(enumerate(frame_windows), total=len(frame_windows))
+        if adaptive_windows: # [start, end) of sampled frames, cut at scene changes
+            window_bounds = scene_windows(
+                multi_signatures,
+                min_len=num_of_frame_in_sequence,
+                max_len=max_window_len or 4 * num_of_frame_in_sequence,
+                threshold=window_change_threshold,
+            )
+            frame_of_interest = FramesofInterest(num_of_frame_in_sequence, frame_step, window_bounds=window_bounds)
+        else:
+            window_bounds = [(i, i + num_of_frame_in_sequence) for i in range(0, len(multi_frames[0]), num_of_frame_in_sequence)] # these are established to be the same length
+            frame_of_interest = FramesofInterest(num_of_frame_in_sequence, frame_step)
+
+        # long windows still send num_of_frame_in_sequence frames per request, spread over the window
+        frame_windows = []
+        for start, end in window_bounds:
+            frame_windows.append([evenly_spaced(frames[start:end], num_of_frame_in_sequence) for frames in multi_frames])
+
+        signature_windows = []
+        if reuse_unchanged:
+            for start, end in window_bounds:
+                signature_windows.append([evenly_spaced(signatures[start:end], num_of_frame_in_sequence) for signatures in multi_signatures])
+        metrics.count("windows", len(frame_windows))
 
-    all_detections = [set(), set()]
-    for i, multi_sequence_of_frames in looper:
         if PRINT_ALL:
-            print("\n" + "*"*50 + f" {i}/{len(frame_windows)-1} " + "*"*50)
-            print(f"Detections:")
-        frame = process_frame(multi_sequence_of_frames, i)
-        if PRINT_ALL: # disabled
-            os.makedirs(image_output_dir, exist_ok=True)
-            frame.save_frame_img(save_path=os.path.join(image_output_dir, f"{i}"))
-
-        if checker.validate_frame(frame_of_interest=frame):
-            thresh = frame.thresholded_detected_objects(threshold=detection_threshold)
-            for prop, (prob, cam_id) in thresh.items():
-                split = checker.check_split(prop)
-                if ((frame.frame_idx, cam_id) not in all_detections[split]):
-                    all_detections[split].add((frame.frame_idx, cam_id))
+            print(f"{len(frame_windows)} frame windows to process")
+            print(f"{len(frame_windows[0])} cameras per frame window")
+            print(f"{len(frame_windows[0][0])} frames per camera per window")
+            print(f"{frame_windows[0][0][0].shape} shape of each frame")
+
+        best_camera = {} # proposition -> camera that won it in the previous window
+        planner = QueryPlanner(checker.frame_validator, proposition) if lazy_propositions else None
+        traced = tracing.enabled() # per-request span attributes are only built when spans are written
+
+        def memoized(keys: list[tuple], requests: list[dict], method: str = "detect") -> list:
+            """vlm.detect_many, but answers found in detection_memo are reused instead of queried"""
+            if detection_memo is None:
+                return vlm.detect_many(requests, method=method)
+            keys = [(bounds, cam, normalize_proposition(prop)) for bounds, cam, prop in keys]
+            missing = [i for i, key in enumerate(keys) if key not in detection_memo]
+            for i, result in zip(missing, vlm.detect_many([requests[i] for i in missing], method=method)):
+                detection_memo[keys[i]] = result
+            metrics.count("memo_hits", len(keys) - len(missing))
+            metrics.count("requests_saved", len(keys) - len(missing))
+
+            results = []
+            for key, request in zip(keys, requests):
+                result = detection_memo[key]
+                # the stored answer may carry another question's spelling of the proposition
+                detected_object = result[1] if method == "detect_cameras" else result
+                renamed = DetectedObject(
+                    name=request["scene_description"],
+                    is_detected=detected_object.is_detected,
+                    confidence=detected_object.confidence,
+                    probability=detected_object.probability,
+                )
+                results.append((result[0], renamed) if method == "detect_cameras" else renamed)
+            return results
+
+        def detect_propositions(props: list[str], multi_sequence_of_frames: list[list[np.ndarray]], frame_images: dict, frame_count: int, absent: dict) -> dict:
+            object_of_interest = {}
+            cam_ids = list(frame_images.keys())
+
+            absent = {prop: missing for prop, missing in absent.items() if prop in props}
+            if absent and not prefilter.audit:
+                for prop, missing in absent.items():
+                    prefilter.log_skip(video_paths, frame_count, prop, missing)
+                    object_of_interest[prop] = (None, DetectedObject(name=prop, is_detected=False, confidence=0.0, probability=0.0))
+                metrics.count("prefilter_skips", len(absent))
+                metrics.count("requests_saved", len(absent) * len(cam_ids))
+                props = [prop for prop in props if prop not in absent]
+
+            per_camera_props = props
+            if camera_mosaic and 1 < len(cam_ids) <= len(CAMERA_LETTERS): # more cameras than letters: ask each one
+                mosaic_requests = [
+                    dict(multi_seq_of_frames=multi_sequence_of_frames, scene_description=prop, threshold=vlm_detection_threshold, metrics=metrics, trace=dict(camera="mosaic") if traced else None)
+                    for prop in props
+                ]
+                per_camera_props = []
+                mosaic_keys = [(window_bounds[frame_count], "mosaic", prop) for prop in props]
+                mosaic_detections = memoized(mosaic_keys, mosaic_requests, method="detect_cameras")
+                for prop, (cam_index, detected_object) in zip(props, mosaic_detections):
+                    low, high = camera_mosaic_band
+                    if low < detected_object.confidence < high:
+                        per_camera_props.append(prop) # ambiguous, fall back to asking every camera
+                        continue
+                    object_of_interest[prop] = (cam_ids[cam_index] if cam_index is not None else None, detected_object)
+                    if PRINT_ALL and detected_object.is_detected:
+                        print(f"\t{prop} ({object_of_interest[prop][0]}, mosaic): {detected_object.confidence}->{detected_object.probability}")
+                metrics.count("mosaic_fallbacks", len(per_camera_props))
+                metrics.count("requests_saved", (len(props) - len(per_camera_props)) * (len(cam_ids) - 1) - len(per_camera_props))
+
+            # which cameras to ask first: all of them, or only last window's winner
+            full_sweep = not adaptive_cameras or frame_count % camera_sweep_interval == 0
+            cameras_to_ask = {
+                prop: cam_ids if full_sweep or best_camera.get(prop) is None else [best_camera[prop]]
+                for prop in per_camera_props
+            }
+            detected = {prop: {} for prop in per_camera_props}
+            while cameras_to_ask:
+                pairs = [(prop, cam_id) for prop, cams in cameras_to_ask.items() for cam_id in cams]
+                requests = [
+                    dict(seq_of_frames=frame_images[cam_id], scene_description=prop, threshold=vlm_detection_threshold, metrics=metrics, trace=dict(camera=cam_id) if traced else None)
+                    for prop, cam_id in pairs
+                ]
+                keys = [(window_bounds[frame_count], cam_id, prop) for prop, cam_id in pairs]
+                for (prop, cam_id), detected_object in zip(pairs, memoized(keys, requests)): # spread this window's queries over every endpoint
+                    detected[prop][cam_id] = detected_object
+                # fan out to the remaining cameras when the predicted camera is not confident
+                cameras_to_ask = {
+                    prop: [cam_id for cam_id in cam_ids if cam_id not in detected[prop]]
+                    for prop, cams in cameras_to_ask.items()
+                    if len(cams) < len(cam_ids) and detected[prop][cams[0]].confidence < camera_fanout_threshold
+                }
+            if adaptive_cameras:
+                metrics.count("requests_saved", sum(len(cam_ids) - len(detected[prop]) for prop in per_camera_props))
+
+            for prop in per_camera_props:
+                best_detection = (None, DetectedObject(name=prop, is_detected=False, confidence=0.0, probability=0.0))
+
+                for cam_id in cam_ids:
+                    detected_object = detected[prop].get(cam_id)
+                    if detected_object is not None and detected_object.confidence > best_detection[1].confidence:
+                        best_detection = (cam_id, detected_object)
+
+                object_of_interest[prop] = best_detection
+                if PRINT_ALL and best_detection[1].is_detected:
+                    print(f"\t{prop} ({best_detection[0]}): {best_detection[1].confidence}->{best_detection[1].probability}")
+
+            if absent and prefilter.audit:
+                for prop, missing in absent.items():
+                    prefilter.log_skip(video_paths, frame_count, prop, missing, vlm_confidence=object_of_interest[prop][1].confidence)
+
+            for prop, (cam_id, _) in object_of_interest.items():
+                if cam_id is not None:
+                    best_camera[prop] = cam_id
+            return object_of_interest
+
+        def process_frame(multi_sequence_of_frames: list[list[np.ndarray]], frame_count: int):
+            frame_images = {f"cam{i}": seq for i, seq in enumerate(multi_sequence_of_frames)}
+            absent = prefilter.absent_objects(multi_sequence_of_frames, proposition) if prefilter is not None else {}
+
+            if planner is None:
+                object_of_interest = detect_propositions(proposition, multi_sequence_of_frames, frame_images, frame_count, absent)
+            else:
+                object_of_interest = {}
+                for stage in planner.stages:
+                    object_of_interest.update(detect_propositions(stage, multi_sequence_of_frames, frame_images, frame_count, absent))
+                    if planner.is_rejected(object_of_interest):
+                        # fails validation whatever the rest are, so the rest are never asked
+                        skipped = [prop for prop in proposition if prop not in object_of_interest]
+                        metrics.count("propositions_skipped", len(skipped))
+                        metrics.count("requests_saved", len(skipped) * len(frame_images))
+                        for prop in skipped:
+                            object_of_interest[prop] = (None, DetectedObject(name=prop, is_detected=False, confidence=0.0, probability=0.0))
+                        unasked[frame_count] = set(skipped)
+                        break
+
+            object_of_interest = {prop: object_of_interest[prop] for prop in proposition} # keep proposition order
+            # print(frame_images.keys(), len(frame_images.values()))
+            # print(object_of_interest)
+            frame = VideoFrame(
+                frame_idx=frame_count,
+                frame_images=frame_images,
+                object_of_interest=object_of_interest,
+            )
+            return frame
+
+        reference = {"index": None, "queried": None, "object_of_interest": None, "streak": 0} # last window and last queried window
+        unasked = {} # window index -> propositions the planner never asked (their 0.0 is a placeholder, not an answer)
+
+        def query_window(i: int) -> VideoFrame:
+            if PRINT_ALL:
+                print("\n" + "*"*50 + f" {i}/{len(frame_windows)-1} " + "*"*50)
+                print(f"Detections:")
+            if reuse_unchanged and reference["index"] == i - 1 and reference["streak"] < max_reuse_streak:
+                distance = window_distance(signature_windows[reference["queried"]], signature_windows[i])
+                if distance is not None and distance < scene_change_threshold:
+                    # nearly identical to the last queried window: keep its detections
+                    reference["index"] = i
+                    reference["streak"] += 1
+                    if reference["queried"] in unasked:
+                        unasked[i] = unasked[reference["queried"]]
+                    metrics.count("windows_reused")
+                    if PRINT_ALL:
+                        print(f"\tunchanged (distance {distance:.4f}), reusing window {reference['queried']}")
+                    frame_images = {f"cam{c}": seq for c, seq in enumerate(frame_windows[i])}
+                    return VideoFrame(frame_idx=i, frame_images=frame_images, object_of_interest=dict(reference["object_of_interest"]))
+            with tracing.context(window=i):
+                frame = process_frame(frame_windows[i], i)
+            reference.update(index=i, queried=i, object_of_interest=frame.object_of_interest, streak=0)
+            if PRINT_ALL: # disabled
+                os.makedirs(image_output_dir, exist_ok=True)
+                frame.save_frame_img(save_path=os.path.join(image_output_dir, f"{i}"))
+            return frame
+
+        def near_threshold(frame: VideoFrame) -> bool:
+            skipped = unasked.get(frame.frame_idx, ())
+            return any(
+                abs(detected_object.probability - detection_threshold) <= coarse_margin
+                for prop, (_, detected_object) in frame.object_of_interest.items() if prop not in skipped
+            )
+
+        coarse_frames = {} # window index -> VideoFrame from the coarse pass
+        if coarse_stride > 1:
+            for i in range(0, len(frame_windows), coarse_stride):
+                coarse_frames[i] = query_window(i)
+            windows = set(coarse_frames)
+            for i, frame in coarse_frames.items():
+                if checker.validate_frame(frame_of_interest=frame) or near_threshold(frame):
+                    windows.update(range(max(0, i - coarse_stride + 1), min(len(frame_windows), i + coarse_stride)))
+            windows = sorted(windows)
+            metrics.count("windows_skipped", len(frame_windows) - len(windows))
             if PRINT_ALL:
-                print(f"\t{[sorted(s) for s in all_detections]}")
+                print(f"Coarse-to-fine: refining {len(windows)}/{len(frame_windows)} windows")
+        else:
+            windows = list(range(len(frame_windows)))
+
+        if PRINT_ALL:
+            looper = windows
+        else:
+            looper = tqdm.tqdm(windows, total=len(windows))
+
+        all_detections = [set(), set()]
+        for i in looper: # windows never queried count as failed validation
+            frame = coarse_frames[i] if i in coarse_frames else query_window(i)
+
+            if checker.validate_frame(frame_of_interest=frame):
+                thresh = frame.thresholded_detected_objects(threshold=detection_threshold)
+                for prop, (prob, cam_id) in thresh.items():
+                    split = checker.check_split(prop)
+                    if ((frame.frame_idx, cam_id) not in all_detections[split]):
+                        all_detections[split].add((frame.frame_idx, cam_id))
+                if PRINT_ALL:
+                    print(f"\t{[sorted(s) for s in all_detections]}")
 
-            automaton.add_frame(frame=frame)
-            frame_of_interest.frame_buffer.append(frame)
-            model_check = checker.check_automaton(automaton=automaton)
-            if model_check:
-                automaton.reset()
-                frame_of_interest.flush_frame_buffer()
+                automaton.add_frame(frame=frame)
+                frame_of_interest.frame_buffer.append(frame)
+                model_check = checker.check_automaton(automaton=automaton)
+                if model_check:
+                    automaton.reset()
+                    frame_of_interest.flush_frame_buffer()
+    finally:
+        if owns_vlm: # also when a detect raises, or every failed entry leaks the router's threads
+            vlm.close()
 
     automaton_foi = frame_of_interest.compile_foi()
     if PRINT_ALL:
@@ -135,7 +386,7 @@ def run_nsvs(
     else:
         detections_with_cams = intersection_with_gaps(all_detections)
         if detections_with_cams:
-            scaled_detections = {k * num_of_frame_in_sequence * frame_step: v for k, v in detections_with_cams.items()}
+            scaled_detections = {window_bounds[k][0] * frame_step: v for k, v in detections_with_cams.items()}
             min_frame = min(scaled_detections.keys())
             max_frame = max(scaled_detections.keys())
             detections_foi = list(range(int(min_frame), int(max_frame) + 1))
@@ -160,5 +411,5 @@ def run_nsvs(
             print(f"All Detections: {all_detections}")
             print(f"Detected frames of interest:\n{foi}")
 
-    return foi, all_detections
+    return foi, all_detections, metrics.to_dict()
 
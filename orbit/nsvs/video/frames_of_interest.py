@@ -1,19 +1,27 @@
 class FramesofInterest:
-    def __init__(self, num_of_frame_in_sequence, frame_step):
+    def __init__(self, num_of_frame_in_sequence, frame_step, window_bounds=None):
         self.num_of_frame_in_sequence = num_of_frame_in_sequence
         self.frame_step = frame_step
+        self.window_bounds = window_bounds # [start, end) sampled-frame range per window, for variable-length windows
         self.foi_list = []
         self.frame_buffer = []
 
+    def window_frames(self, frame_idx):
+        """Source frame indices covered by window frame_idx"""
+        if self.window_bounds is None:
+            total_step = self.num_of_frame_in_sequence * self.frame_step
+            return range(frame_idx*total_step, (frame_idx+1)*total_step)
+        start, end = self.window_bounds[frame_idx]
+        return range(start*self.frame_step, end*self.frame_step)
+
     def flush_frame_buffer(self):
         """Flush frame buffer to frame of interest."""
         if self.frame_buffer:
             frame_interval = [frame.frame_idx for frame in self.frame_buffer]
-            total_step = self.num_of_frame_in_sequence * self.frame_step
             self.foi_list.append([
-                i*total_step + j 
+                j
                 for i in frame_interval 
-                for j in range(total_step)
+                for j in self.window_frames(i)
             ])
             self.frame_buffer = []
 
@@ -0,0 +1,49 @@
+from typing import List, Optional
+import numpy as np
+import math
+import cv2
+
+
+def draw_label(frame: np.ndarray, label: str, scale: float = 0.7) -> np.ndarray:
+    """Label in the top-left corner, dark outline so it stays readable on bright frames"""
+    labeled_frame = frame.copy()
+    thickness = max(1, int(round(scale * 2)))
+    origin = (5, int(20 * scale) + 5)
+    cv2.putText(labeled_frame, label, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, (0, 0, 0), thickness + 2)
+    cv2.putText(labeled_frame, label, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, (255, 255, 255), thickness)
+    return labeled_frame
+
+def tile_frames(
+    frames: List[np.ndarray],
+    labels: Optional[List[str]] = None,
+    cols: Optional[int] = None,
+    max_side: Optional[int] = None,
+) -> np.ndarray:
+    """Tile frames row-major into one labeled grid image.
+
+    Tiles keep the first frame's size; empty cells are black. With `max_side`, the finished grid
+    is scaled down so its longer side fits.
+    """
+    if not frames:
+        raise ValueError("No frames to tile")
+    if labels is None:
+        labels = [str(i + 1) for i in range(len(frames))]
+    if cols is None:
+        cols = math.ceil(math.sqrt(len(frames)))
+    rows = math.ceil(len(frames) / cols)
+
+    height, width = frames[0].shape[:2]
+    scale = max(height, width) / 640
+    tiles = []
+    for frame, label in zip(frames, labels):
+        if frame.shape[:2] != (height, width):
+            frame = cv2.resize(frame, (width, height))
+        tiles.append(draw_label(frame, label, scale=max(0.5, scale)))
+    for _ in range(rows * cols - len(tiles)):
+        tiles.append(np.zeros_like(tiles[0]))
+
+    grid = cv2.vconcat([cv2.hconcat(tiles[r * cols:(r + 1) * cols]) for r in range(rows)])
+    if max_side and max(grid.shape[:2]) > max_side:
+        factor = max_side / max(grid.shape[:2])
+        grid = cv2.resize(grid, (round(grid.shape[1] * factor), round(grid.shape[0] * factor)), interpolation=cv2.INTER_AREA)
+    return grid
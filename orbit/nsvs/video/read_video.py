@@ -4,6 +4,9 @@ import tqdm
 import cv2
 import os
 
+from orbit.nsvs.video.scene_change import frame_signature
+from orbit.utils import tracing
+
 
 class Mp4Reader():
     def __init__(self, path: str, sample_rate: float = 1.0):
@@ -24,6 +27,10 @@ class Mp4Reader():
         return idxs
 
     def read_video(self):
+        with tracing.span("read_video", path=self.path):
+            return self._read_video()
+
+    def _read_video(self):
         cap = cv2.VideoCapture(self.path)
 
         fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
@@ -34,6 +41,7 @@ class Mp4Reader():
         frame_idxs = self._sampled_frame_indices(fps, frame_count)
 
         images: List[np.ndarray] = []
+        signatures: List[np.ndarray] = [] # for scene-change detection in run_nsvs
 
         current_frame_idx = 0
         target_idx_pos = 0
@@ -46,6 +54,7 @@ class Mp4Reader():
                 if current_frame_idx == target_frame:
                     frame_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
                     images.append(frame_rgb)
+                    signatures.append(frame_signature(frame_rgb))
                     pbar.update(1)
                     target_idx_pos += 1
                     if target_idx_pos >= len(frame_idxs):
@@ -69,6 +78,7 @@ class Mp4Reader():
             "sample_rate": self.sample_rate,
             "video_info": video_info,
             "images": images,
+            "signatures": signatures,
         }
         return output
 
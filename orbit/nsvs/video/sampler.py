@@ -0,0 +1,135 @@
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+import cv2
+import os
+
+try:
+    import decord
+except ImportError:
+    decord = None
+
+
+SEEK_GAP = 30 # frames; past this gap a seek is cheaper than grabbing through
+
+
+def get_video_frame_count(video_path: str) -> int:
+    cap = cv2.VideoCapture(video_path)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    cap.release()
+    return frame_count
+
+def uniform_indices(frame_count: int, num_frames: int) -> List[int]:
+    if frame_count < num_frames:
+        return list(range(frame_count))
+    return [int(i) for i in np.linspace(0, frame_count - 1, num_frames, dtype=int)]
+
+def interleaved_indices(frame_count: int, num_videos: int, num_frames: int) -> List[Tuple[int, int]]:
+    """Uniform samples over the timeline of all videos interleaved frame by frame, as (video_idx, frame_idx)"""
+    global_indices = uniform_indices(frame_count * num_videos, num_frames)
+    return [(g_idx % num_videos, g_idx // num_videos) for g_idx in global_indices]
+
+def read_frames(video_path: str, frame_indices: Iterable[int], backend: str = "auto") -> Dict[int, np.ndarray]:
+    """Decode the requested frames (RGB) in a single forward pass"""
+    frame_indices = sorted(set(frame_indices))
+    if not frame_indices:
+        return {}
+    if backend == "decord" or (backend == "auto" and decord is not None):
+        return _read_frames_decord(video_path, frame_indices)
+    return _read_frames_cv2(video_path, frame_indices)
+
+def _read_frames_decord(video_path: str, frame_indices: List[int]) -> Dict[int, np.ndarray]:
+    vr = decord.VideoReader(video_path, ctx=decord.cpu(0))
+    frame_indices = [idx for idx in frame_indices if idx < len(vr)]
+    if not frame_indices:
+        return {}
+    batch = vr.get_batch(frame_indices).asnumpy()
+    return {idx: batch[i] for i, idx in enumerate(frame_indices)}
+
+def _read_frames_cv2(video_path: str, frame_indices: List[int]) -> Dict[int, np.ndarray]:
+    frames = {}
+    cap = cv2.VideoCapture(video_path)
+    current = 0
+    for idx in frame_indices:
+        if idx - current > SEEK_GAP:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+            current = idx
+        while current < idx and cap.grab():
+            current += 1
+        if current != idx or not cap.grab():
+            break
+        current += 1
+        ok, frame_bgr = cap.retrieve()
+        if ok and frame_bgr is not None:
+            frames[idx] = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
+    cap.release()
+    return frames
+
+
+class FrameSampler:
+    """Uniform frame sampling over one or more videos with memoized decodes.
+
+    Decoded frames are cached per video path for the `max_cached_videos` most recently used
+    videos, so callers sampling the same videos with different layouts (per camera, interleaved,
+    single camera) can `prefetch` the union of their indices and decode each video once.
+    """
+    def __init__(self, max_cached_videos: int = 16, backend: str = "auto"):
+        self.max_cached_videos = max_cached_videos
+        self.backend = backend
+        self._frames: "OrderedDict[str, Dict[int, np.ndarray]]" = OrderedDict()
+        self._frame_counts: Dict[str, int] = {}
+
+    def frame_count(self, video_path: str) -> int:
+        if video_path not in self._frame_counts:
+            self._frame_counts[video_path] = get_video_frame_count(video_path)
+        return self._frame_counts[video_path]
+
+    def prefetch(self, plan: Dict[str, Iterable[int]]) -> None:
+        """Decode every missing (video_path -> frame indices) in one pass per video"""
+        for video_path, frame_indices in plan.items():
+            cached = self._frames.setdefault(video_path, {})
+            self._frames.move_to_end(video_path)
+            missing = [idx for idx in frame_indices if idx not in cached]
+            if missing:
+                cached.update(read_frames(video_path, missing, backend=self.backend))
+                # indices past the end of the video decode to nothing; remember that too
+                cached.update({idx: None for idx in missing if idx not in cached})
+        while len(self._frames) > self.max_cached_videos:
+            self._frames.popitem(last=False)
+
+    def get(self, video_path: str, frame_indices: Iterable[int]) -> List[np.ndarray]:
+        frame_indices = list(frame_indices)
+        self.prefetch({video_path: frame_indices})
+        cached = self._frames[video_path]
+        return [cached[idx] for idx in frame_indices if cached.get(idx) is not None]
+
+    def uniform_plan(self, video_paths: List[str], num_frames: int) -> Dict[str, List[int]]:
+        return {path: uniform_indices(self.frame_count(path), num_frames) for path in video_paths}
+
+    def interleaved_plan(self, video_paths: List[str], num_frames: int) -> Dict[str, List[int]]:
+        plan = {path: [] for path in video_paths}
+        for video_idx, frame_idx in interleaved_indices(self.frame_count(video_paths[0]), len(video_paths), num_frames):
+            plan[video_paths[video_idx]].append(frame_idx)
+        return plan
+
+    def uniform(self, video_paths: List[str], num_frames: int) -> Dict[str, List[np.ndarray]]:
+        """`num_frames` uniform samples from each video, keyed by camera name"""
+        frames_by_cam = {}
+        for path, frame_indices in self.uniform_plan(video_paths, num_frames).items():
+            cam_name = os.path.basename(path).split(".")[0]
+            frames_by_cam[cam_name] = self.get(path, frame_indices)
+        return frames_by_cam
+
+    def interleaved(self, video_paths: List[str], num_frames: int) -> List[np.ndarray]:
+        """`num_frames` uniform samples over all videos interleaved frame by frame"""
+        samples = interleaved_indices(self.frame_count(video_paths[0]), len(video_paths), num_frames)
+        self.prefetch(self.interleaved_plan(video_paths, num_frames))
+        images = []
+        for video_idx, frame_idx in samples:
+            frame = self._frames[video_paths[video_idx]].get(frame_idx)
+            if frame is not None:
+                images.append(frame)
+        return images
+
+    def clear(self) -> None:
+        self._frames.clear()
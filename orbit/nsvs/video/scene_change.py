@@ -0,0 +1,55 @@
+from typing import List, Optional
+import numpy as np
+import cv2
+
+
+SIGNATURE_SIZE = 32
+
+
+def frame_signature(frame: np.ndarray, size: int = SIGNATURE_SIZE) -> np.ndarray:
+    """Tiny grayscale thumbnail of an RGB frame, cheap enough to compute for every decoded frame"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY) if frame.ndim == 3 else frame
+    return cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA)
+
+def signature_distance(a: np.ndarray, b: np.ndarray) -> float:
+    """Mean absolute difference of two signatures, in [0, 1]"""
+    return float(np.mean(cv2.absdiff(a, b))) / 255.0
+
+def window_distance(a: List[List[np.ndarray]], b: List[List[np.ndarray]]) -> Optional[float]:
+    """Largest per-frame distance between two windows (cameras x frames of signatures); None if their shapes differ"""
+    if len(a) != len(b) or any(len(x) != len(y) for x, y in zip(a, b)):
+        return None
+    return max(signature_distance(x, y) for seq_a, seq_b in zip(a, b) for x, y in zip(seq_a, seq_b))
+
+def scene_windows(
+    multi_signatures: List[List[np.ndarray]],
+    min_len: int,
+    max_len: int,
+    threshold: float,
+) -> List[tuple]:
+    """Split sampled frames into [start, end) windows that end at scene or motion changes.
+
+    A window closes before frame t when the change from t-1 to t (largest over cameras) reaches
+    `threshold` and the window already has `min_len` frames, or when it reaches `max_len` frames,
+    so static stretches become long windows and busy ones short.
+    """
+    num_frames = min(len(signatures) for signatures in multi_signatures)
+    windows = []
+    start = 0
+    for t in range(1, num_frames + 1):
+        length = t - start
+        if t == num_frames or length >= max_len:
+            windows.append((start, t))
+            start = t
+        elif length >= min_len:
+            change = max(signature_distance(signatures[t - 1], signatures[t]) for signatures in multi_signatures)
+            if change >= threshold:
+                windows.append((start, t))
+                start = t
+    return windows
+
+def evenly_spaced(seq: list, k: int) -> list:
+    """k items spread over seq, first and last included; seq itself if it is no longer than k"""
+    if len(seq) <= k:
+        return list(seq)
+    return [seq[round(i * (len(seq) - 1) / (k - 1))] for i in range(k)] if k > 1 else [seq[0]]
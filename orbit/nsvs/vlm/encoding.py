@@ -0,0 +1,81 @@
+import numpy as np
+import hashlib
+import base64
+import cv2
+import os
+
+
+class ImageEncoder:
+    """Image payload policy for VLM requests: resize, codec, quality and per-request dedupe.
+
+    The defaults (full resolution, JPEG at OpenCV's default quality 95, no dedupe) match what the
+    clients always sent. `from_env` lets every script pick up one policy from ORBIT_IMAGE_MAX_SIDE,
+    ORBIT_IMAGE_FORMAT, ORBIT_IMAGE_QUALITY and ORBIT_IMAGE_DEDUPE.
+    """
+    def __init__(
+        self,
+        max_side: int | None = None,
+        quality: int = 95,
+        image_format: str = "jpeg",
+        dedupe: bool = False,
+    ):
+        if image_format not in ("jpeg", "webp"):
+            raise ValueError(f"Unsupported image format: {image_format}")
+        self.max_side = max_side
+        self.quality = quality
+        self.image_format = image_format
+        self.dedupe = dedupe
+
+    @classmethod
+    def from_env(cls) -> "ImageEncoder":
+        max_side = os.environ.get("ORBIT_IMAGE_MAX_SIDE")
+        return cls(
+            max_side=int(max_side) if max_side else None,
+            quality=int(os.environ.get("ORBIT_IMAGE_QUALITY", 95)),
+            image_format=os.environ.get("ORBIT_IMAGE_FORMAT", "jpeg"),
+            dedupe=os.environ.get("ORBIT_IMAGE_DEDUPE", "0") == "1",
+        )
+
+    def __repr__(self) -> str:
+        return f"ImageEncoder(max_side={self.max_side}, quality={self.quality}, format={self.image_format}, dedupe={self.dedupe})"
+
+    @property
+    def mime_type(self) -> str:
+        return f"image/{self.image_format}"
+
+    def resize(self, frame: np.ndarray) -> np.ndarray:
+        height, width = frame.shape[:2]
+        if not self.max_side or max(height, width) <= self.max_side:
+            return frame
+        scale = self.max_side / max(height, width)
+        return cv2.resize(frame, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+    def encode_bytes(self, frame: np.ndarray) -> bytes:
+        frame = self.resize(frame)
+        if self.image_format == "webp":
+            ret, buffer = cv2.imencode(".webp", frame, [cv2.IMWRITE_WEBP_QUALITY, self.quality])
+        else:
+            ret, buffer = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ret:
+            raise ValueError("Could not encode frame")
+        return buffer.tobytes()
+
+    def encode(self, frame: np.ndarray) -> str:
+        return base64.b64encode(self.encode_bytes(frame)).decode("utf-8")
+
+    def data_url(self, frame: np.ndarray) -> str:
+        return f"data:{self.mime_type};base64,{self.encode(frame)}"
+
+    def data_urls(self, frames: list[np.ndarray]) -> list[str]:
+        """Data URLs for a request's frames; with dedupe, byte-identical frames are sent once"""
+        if not self.dedupe:
+            return [self.data_url(frame) for frame in frames]
+        urls = []
+        seen = set()
+        for frame in frames:
+            digest = hashlib.blake2b(np.ascontiguousarray(frame).tobytes(), digest_size=16).digest()
+            if digest in seen:
+                continue
+            seen.add(digest)
+            urls.append(self.data_url(frame))
+        return urls
@@ -0,0 +1,114 @@
+from collections import defaultdict
+import threading
+import json
+import math
+
+
+class Histogram:
+    """Power-of-two bucketed histogram; cheap to update and to merge across entries and runs."""
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = defaultdict(int) # exponent e -> number of values in (2^(e-1), 2^e]
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        exponent = math.ceil(math.log2(value)) if value > 0 else -64
+        self.buckets[exponent] += 1
+
+    def quantile(self, q: float) -> float | None:
+        """Upper bound of the bucket holding the q-quantile"""
+        if self.count == 0:
+            return None
+        target = q * self.count
+        seen = 0
+        for exponent in sorted(self.buckets):
+            seen += self.buckets[exponent]
+            if seen >= target:
+                return min(2.0 ** exponent, self.max)
+        return self.max
+
+    def merge(self, other: dict) -> None:
+        if not other or not other.get("count"):
+            return
+        self.count += other["count"]
+        self.total += other["sum"]
+        self.min = other["min"] if self.min is None else min(self.min, other["min"])
+        self.max = other["max"] if self.max is None else max(self.max, other["max"])
+        for exponent, n in other["buckets"].items():
+            self.buckets[int(exponent)] += n
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.total / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": {str(e): self.buckets[e] for e in sorted(self.buckets)},
+        }
+
+
+class VLMMetrics:
+    """Thread-safe aggregate of per-request VLM measurements (one per entry, one per run)."""
+    HISTOGRAMS = [
+        "encode_s",
+        "payload_bytes",
+        "queue_wait_s",
+        "server_latency_s",
+        "prompt_tokens",
+        "completion_tokens",
+        "cached_tokens",
+    ]
+    COUNTERS = ["requests", "errors", "cache_hits", "cache_misses", "cache_unknown"]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {name: Histogram() for name in self.HISTOGRAMS}
+        self.counters = {name: 0 for name in self.COUNTERS}
+
+    def record(self, **values) -> None:
+        """Record one request; values are histogram names (None = not measured) plus `error` or `cache_hit`"""
+        with self._lock:
+            self.counters["requests"] += 1
+            if values.pop("error", False):
+                self.counters["errors"] += 1
+            cache_hit = values.pop("cache_hit", None)
+            if cache_hit is None:
+                self.counters["cache_unknown"] += 1
+            else:
+                self.counters["cache_hits" if cache_hit else "cache_misses"] += 1
+            for name, value in values.items():
+                if value is not None:
+                    self.histograms[name].add(value)
+
+    def count(self, name: str, n: int = 1) -> None:
+        """Bump a named counter outside of request records (e.g. requests a scheduler avoided)"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, other: dict) -> None:
+        with self._lock:
+            for name, n in other.get("counters", {}).items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            for name, histogram in other.get("histograms", {}).items():
+                self.histograms.setdefault(name, Histogram()).merge(histogram)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {name: h.to_dict() for name, h in self.histograms.items()},
+            }
+
+    def dump(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=4)
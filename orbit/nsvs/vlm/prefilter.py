@@ -0,0 +1,164 @@
+import threading
+import logging
+import json
+import os
+import re
+
+import numpy as np
+
+from orbit.nsvs.video.scene_change import evenly_spaced
+
+
+# nouns that name exactly one detector class (COCO names of the stock YOLO weights); looser
+# words ("table", "glass", "ball", "monitor", ...) cover objects the class misses and stay out
+SYNONYMS = {
+    "man": "person",
+    "men": "person",
+    "woman": "person",
+    "women": "person",
+    "people": "person",
+    "persons": "person",
+    "phone": "cell phone",
+    "phones": "cell phone",
+    "cellphone": "cell phone",
+    "smartphone": "cell phone",
+    "bike": "bicycle",
+    "bikes": "bicycle",
+    "motorbike": "motorcycle",
+    "sofa": "couch",
+    "television": "tv",
+    "fridge": "refrigerator",
+    "knives": "knife",
+    "buses": "bus",
+}
+
+# class names that are as often another word (a colour, a verb, an animal, an instrument);
+# a proposition only maps to them through a longer, unambiguous phrase
+STOPLIST = {
+    "orange", "tie", "mouse", "remote", "keyboard", "bat", "bear", "train", "sink", "bowl",
+    "book", "clock", "kite", "apple", "bench", "fork", "oven", "cake", "bed", "skis",
+}
+
+# a negated proposition ("no person in the room") is true exactly when the object is missing
+NEGATIONS = {"no", "not", "without", "none", "nobody", "nothing", "empty"}
+
+
+def plural(name: str) -> str:
+    return name + "es" if name.endswith(("s", "x", "ch", "sh")) else name + "s"
+
+def noun_map(class_names) -> dict[str, str]:
+    """Proposition noun (or multi-word phrase) -> detector class, for the classes the model has"""
+    class_names = {name.lower() for name in class_names}
+    nouns = {}
+    for name in class_names:
+        if name in STOPLIST:
+            continue
+        nouns[name] = name
+        nouns[plural(name)] = name
+    for word, name in SYNONYMS.items():
+        if name in class_names:
+            nouns[word] = name
+    return nouns
+
+def match_objects(proposition: str, nouns: dict[str, str]) -> list[str] | None:
+    """Detector classes a proposition names, e.g. 'person holds knife' -> ['person', 'knife'].
+
+    None when the proposition is negated, since its truth no longer needs the objects present.
+    """
+    text = proposition.replace("_", " ").lower()
+    words = re.findall(r"[a-z]+", text)
+    if NEGATIONS.intersection(words):
+        return None
+    # longest phrase first, so "teddy bear" is one match rather than "teddy" and "bear"
+    pattern = r"\b(" + "|".join(re.escape(noun) for noun in sorted(nouns, key=len, reverse=True)) + r")\b"
+    objects = []
+    for match in re.finditer(pattern, text):
+        if nouns[match[1]] not in objects:
+            objects.append(nouns[match[1]])
+    return objects
+
+
+class ObjectPrefilter:
+    """Local YOLO pass that rules out propositions whose objects are clearly not in a window.
+
+    Proposition words are mapped to detector classes only through an explicit noun map (class
+    names and their plurals, SYNONYMS) minus an ambiguity STOPLIST; other words are ignored, and
+    negated propositions are never ruled out. A proposition is only ruled out when one of its
+    mapped objects scores below `absent_confidence` in every sampled frame of every camera.
+    Every ruled-out proposition is logged (and appended to `log_path` as JSONL). With `audit`, the
+    VLM is still queried and its answer is logged next to the pre-filter's decision.
+    """
+    def __init__(
+        self,
+        weights_path: str,
+        absent_confidence: float = 0.1,
+        frames_per_camera: int | None = None,
+        device: str = "cpu",
+        imgsz: int = 640,
+        log_path: str | None = None,
+        audit: bool = False,
+    ):
+        if not os.path.isfile(weights_path):
+            raise FileNotFoundError(f"YOLO weights not found at {weights_path}") # never let ultralytics download them
+        from ultralytics import YOLO # heavy import, only when the pre-filter is used
+
+        self.model = YOLO(weights_path)
+        self.class_names = {name.lower() for name in self.model.names.values()}
+        self.nouns = noun_map(self.class_names)
+        self.absent_confidence = absent_confidence
+        self.frames_per_camera = frames_per_camera
+        self.device = device
+        self.imgsz = imgsz
+        self.log_path = log_path
+        self.audit = audit
+        self._lock = threading.Lock()
+
+    def required_objects(self, proposition: str) -> list[str]:
+        """Detector classes named by a proposition; empty when it can't safely be ruled out"""
+        return match_objects(proposition, self.nouns) or []
+
+    def class_confidences(self, multi_seq_of_frames: list[list[np.ndarray]]) -> dict[str, float]:
+        """Highest detection confidence per class over the sampled frames of every camera"""
+        frames = []
+        for seq in multi_seq_of_frames:
+            frames.extend(evenly_spaced(seq, self.frames_per_camera) if self.frames_per_camera else seq)
+        results = self.model.predict(
+            [np.ascontiguousarray(frame[..., ::-1]) for frame in frames], # RGB -> BGR
+            conf=self.absent_confidence,
+            imgsz=self.imgsz,
+            device=self.device,
+            verbose=False,
+        )
+        confidences = {}
+        for result in results:
+            for cls, conf in zip(result.boxes.cls.tolist(), result.boxes.conf.tolist()):
+                name = result.names[int(cls)].lower()
+                confidences[name] = max(confidences.get(name, 0.0), conf)
+        return confidences
+
+    def absent_objects(self, multi_seq_of_frames: list[list[np.ndarray]], propositions: list[str]) -> dict[str, list[str]]:
+        """Propositions ruled out in this window -> the required objects that were not seen"""
+        required = {prop: self.required_objects(prop) for prop in propositions}
+        if not any(required.values()):
+            return {}
+        confidences = self.class_confidences(multi_seq_of_frames)
+        absent = {}
+        for prop, objects in required.items():
+            missing = [name for name in objects if confidences.get(name, 0.0) < self.absent_confidence]
+            if missing:
+                absent[prop] = missing
+        return absent
+
+    def log_skip(self, video_paths: list[str], window: int, proposition: str, missing: list[str], vlm_confidence: float | None = None) -> None:
+        record = {
+            "video_paths": video_paths,
+            "window": window,
+            "proposition": proposition,
+            "missing": missing,
+            "audit": self.audit,
+            "vlm_confidence": vlm_confidence,
+        }
+        logging.info("Pre-filter skip: %s", record)
+        if self.log_path:
+            with self._lock, open(self.log_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
@@ -0,0 +1,321 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from collections import deque
+import numpy as np
+import threading
+import logging
+import random
+import openai
+import httpx
+import time
+
+from orbit.nsvs.vlm.vllm_client import VLLMClient
+from orbit.nsvs.vlm.encoding import ImageEncoder
+from orbit.nsvs.vlm.metrics import VLMMetrics
+from orbit.nsvs.vlm.obj import DetectedObject
+from orbit.utils import profiling, tracing
+
+
+def is_transient(error: Exception) -> bool:
+    """Transport, timeout, overload and 5xx errors; anything else (bad request, unparsable answer) would fail again"""
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError, TimeoutError, ConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500 or error.status_code == 429
+    return False
+
+
+class RetryBudget:
+    """Token bucket capping retries to a fraction of traffic, so retries cannot snowball into an overload."""
+    def __init__(self, ratio: float = 0.1, min_tokens: float = 10.0, max_tokens: float = 100.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = min_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+            return True
+
+
+class Endpoint:
+    """One vLLM server and the routing state kept for it."""
+    def __init__(self, api_base: str, model: str, api_key: str = "EMPTY", timeout: float | None = None, encoder: ImageEncoder | None = None, mosaic: bool = False):
+        self.api_base = api_base
+        self.client = VLLMClient(api_key=api_key, api_base=api_base, model=model, encoder=encoder, mosaic=mosaic)
+        # retries are handled by the router, not inside the OpenAI client
+        options = {"max_retries": 0}
+        if timeout:
+            options["timeout"] = timeout
+        self.client.client = self.client.client.with_options(**options)
+        self.in_flight = 0
+        self.ewma_latency = None
+        self.consecutive_failures = 0
+        self.healthy = True
+        self.num_requests = 0
+        self.num_failures = 0
+
+    def expected_wait(self) -> float:
+        # queue position times the typical service time; unmeasured endpoints get probed first
+        return (self.in_flight + 1) * (self.ewma_latency or 0.0)
+
+    def __repr__(self) -> str:
+        return f"Endpoint({self.api_base}, in_flight={self.in_flight}, ewma={self.ewma_latency}, healthy={self.healthy})"
+
+
+class VLLMRouter:
+    """Client-side router over several vLLM servers.
+
+    Each detect goes to the healthy endpoint with the least expected wait (in-flight requests
+    weighted by EWMA latency). Endpoints that fail `max_failures` requests in a row, or fail
+    the periodic health check, are drained until a health check passes again.
+
+    Attempts that fail with a transient error (see is_transient) count against their endpoint and
+    are retried on another endpoint with full-jitter exponential backoff, up to `max_retries` per
+    request and within a shared RetryBudget; other errors are raised right away. With `hedge_percentile` set, an
+    attempt still running after that percentile of recent latencies is duplicated on a second
+    endpoint and the first answer wins. `request_deadline` bounds the total time of one detect.
+    """
+    def __init__(
+        self,
+        api_bases: list[str],
+        model: str = "OpenGVLab/InternVL2_5-8B",
+        api_key: str = "EMPTY",
+        ewma_alpha: float = 0.2,
+        max_failures: int = 3,
+        health_check_interval: float = 10.0,
+        max_workers_per_endpoint: int = 8,
+        max_retries: int = 2,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 8.0,
+        retry_budget: RetryBudget | None = None,
+        hedge_percentile: float | None = None,
+        hedge_min_samples: int = 20,
+        request_deadline: float | None = None,
+        encoder: ImageEncoder | None = None,
+        mosaic: bool = False,
+    ):
+        if not api_bases:
+            raise ValueError("VLLMRouter needs at least one endpoint")
+        self.model = model
+        self.endpoints = [Endpoint(api_base, model, api_key, timeout=request_deadline, encoder=encoder, mosaic=mosaic) for api_base in api_bases]
+        self.ewma_alpha = ewma_alpha
+        self.max_failures = max_failures
+        self.health_check_interval = health_check_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.retry_budget = retry_budget if retry_budget is not None else RetryBudget()
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.request_deadline = request_deadline
+        self.num_retries = 0
+        self.num_hedges = 0
+        self.num_hedge_wins = 0
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self.metrics = VLMMetrics() # run-level; callers pass a per-entry VLMMetrics through detect
+        for endpoint in self.endpoints:
+            endpoint.client.metrics = self.metrics
+        max_workers = max_workers_per_endpoint * len(self.endpoints)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # attempts run on their own pool: detect_many workers block on them, so sharing one pool could deadlock
+        self._attempt_executor = ThreadPoolExecutor(max_workers=2 * max_workers)
+        self._stop = threading.Event()
+        self._health_thread = None
+        if health_check_interval:
+            self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+            self._health_thread.start()
+
+    def _acquire(self, exclude: set | None = None) -> Endpoint:
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.healthy and e not in (exclude or ())]
+            if not candidates:
+                # everything is drained; keep trying the least-failed endpoint rather than stalling
+                candidates = [min(self.endpoints, key=lambda e: e.consecutive_failures)]
+            endpoint = min(candidates, key=lambda e: (e.expected_wait(), e.in_flight))
+            endpoint.in_flight += 1
+            endpoint.num_requests += 1
+            return endpoint
+
+    def _release(self, endpoint: Endpoint, latency: float | None, failed: bool = True) -> None:
+        with self._lock:
+            endpoint.in_flight -= 1
+            if latency is None and not failed:
+                return # the request was at fault, not the endpoint
+            if latency is None:
+                endpoint.num_failures += 1
+                endpoint.consecutive_failures += 1
+                if endpoint.consecutive_failures >= self.max_failures and endpoint.healthy:
+                    logging.warning("Draining vLLM endpoint %s after %d failures", endpoint.api_base, endpoint.consecutive_failures)
+                    endpoint.healthy = False
+                return
+            endpoint.consecutive_failures = 0
+            self._latencies.append(latency)
+            if endpoint.ewma_latency is None:
+                endpoint.ewma_latency = latency
+            else:
+                endpoint.ewma_latency = self.ewma_alpha * latency + (1 - self.ewma_alpha) * endpoint.ewma_latency
+
+    def _call(self, endpoint: Endpoint, request: dict, enqueued_at: float, method: str = "detect"):
+        start = time.perf_counter()
+        try:
+            detected_object = getattr(endpoint.client, method)(**request, queue_wait=start - enqueued_at)
+        except Exception as e:
+            self._release(endpoint, None, failed=is_transient(e))
+            raise
+        self._release(endpoint, time.perf_counter() - start)
+        return detected_object
+
+    def _hedge_delay(self) -> float | None:
+        if self.hedge_percentile is None or len(self.endpoints) < 2:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+            return float(np.percentile(self._latencies, self.hedge_percentile))
+
+    def _remaining(self, deadline: float | None) -> float | None:
+        return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+    def _attempt(self, request: dict, deadline: float | None, tried: set, enqueued_at: float, method: str):
+        endpoint = self._acquire(exclude=tried)
+        tried.add(endpoint)
+        futures = {self._attempt_executor.submit(profiling.follow(tracing.propagate(self._call)), endpoint, request, enqueued_at, method)}
+        hedge = None
+
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is not None:
+            remaining = self._remaining(deadline)
+            done, _ = wait(futures, timeout=hedge_delay if remaining is None else min(hedge_delay, remaining))
+            if not done and any(e.healthy and e is not endpoint for e in self.endpoints):
+                hedge_endpoint = self._acquire(exclude={endpoint})
+                tried.add(hedge_endpoint)
+                hedge = self._attempt_executor.submit(profiling.follow(tracing.propagate(self._call)), hedge_endpoint, request, enqueued_at, method)
+                futures.add(hedge)
+                with self._lock:
+                    self.num_hedges += 1
+
+        error = None
+        while futures:
+            done, futures = wait(futures, timeout=self._remaining(deadline), return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"detect exceeded its {self.request_deadline}s deadline")
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.num_hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def detect(
+        self,
+        seq_of_frames,
+        scene_description: str,
+        threshold: float,
+        metrics: VLMMetrics | None = None,
+    ) -> DetectedObject:
+        request = dict(seq_of_frames=seq_of_frames, scene_description=scene_description, threshold=threshold, metrics=metrics)
+        return self._detect(request, time.perf_counter())
+
+    def detect_cameras(
+        self,
+        multi_seq_of_frames,
+        scene_description: str,
+        threshold: float,
+        metrics: VLMMetrics | None = None,
+    ) -> tuple[int | None, DetectedObject]:
+        """VLLMClient.detect_cameras with the same routing, retries and deadline as detect"""
+        request = dict(multi_seq_of_frames=multi_seq_of_frames, scene_description=scene_description, threshold=threshold, metrics=metrics)
+        return self._detect(request, time.perf_counter(), method="detect_cameras")
+
+    def _detect(self, request: dict, enqueued_at: float, method: str = "detect"):
+        trace = request.pop("trace", None) # span attributes for this request, e.g. {"camera": "cam0"}
+        if trace:
+            with tracing.context(**trace):
+                return self._detect(request, enqueued_at, method)
+        scene_description = request["scene_description"]
+        deadline = time.monotonic() + self.request_deadline if self.request_deadline else None
+        self.retry_budget.deposit()
+
+        tried = set()
+        retries = 0
+        while True:
+            try:
+                return self._attempt(request, deadline, tried, enqueued_at, method)
+            except Exception as e:
+                if not is_transient(e):
+                    raise
+                remaining = self._remaining(deadline)
+                if retries >= self.max_retries or remaining == 0.0 or not self.retry_budget.withdraw():
+                    raise
+                retries += 1
+                with self._lock:
+                    self.num_retries += 1
+                if len(tried) >= len(self.endpoints):
+                    tried = set() # every endpoint has been tried once; allow any again
+                backoff = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** retries))
+                logging.warning("Retrying detect('%s') in %.2fs after %r", scene_description, backoff, e)
+                time.sleep(backoff if remaining is None else min(backoff, remaining))
+
+    def detect_many(self, requests: list[dict], method: str = "detect") -> list:
+        """Fan detect (or detect_cameras) kwargs out over all endpoints; results in request order.
+
+        A request may carry a "trace" dict of span attributes (see orbit.utils.tracing).
+        """
+        futures = [self._executor.submit(profiling.follow(tracing.propagate(self._detect)), dict(request), time.perf_counter(), method) for request in requests]
+        return [future.result() for future in futures]
+
+    def _is_alive(self, endpoint: Endpoint) -> bool:
+        try:
+            response = httpx.get(f"{endpoint.api_base}/models", timeout=5.0)
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    def _health_loop(self) -> None:
+        while not self._stop.wait(self.health_check_interval):
+            for endpoint in self.endpoints:
+                alive = self._is_alive(endpoint)
+                with self._lock:
+                    if alive and not endpoint.healthy:
+                        logging.warning("vLLM endpoint %s is healthy again", endpoint.api_base)
+                        endpoint.consecutive_failures = 0
+                    elif not alive and endpoint.healthy:
+                        logging.warning("Draining vLLM endpoint %s after failed health check", endpoint.api_base)
+                    endpoint.healthy = alive
+
+    def stats(self) -> dict:
+        with self._lock:
+            endpoints = [
+                {
+                    "api_base": e.api_base,
+                    "healthy": e.healthy,
+                    "in_flight": e.in_flight,
+                    "ewma_latency": e.ewma_latency,
+                    "num_requests": e.num_requests,
+                    "num_failures": e.num_failures,
+                }
+                for e in self.endpoints
+            ]
+            return {
+                "endpoints": endpoints,
+                "num_retries": self.num_retries,
+                "num_hedges": self.num_hedges,
+                "num_hedge_wins": self.num_hedge_wins,
+                "retry_tokens": self.retry_budget.tokens,
+            }
+
+    def close(self) -> None:
+        self._stop.set()
+        self._executor.shutdown(wait=False)
+        self._attempt_executor.shutdown(wait=False)
@@ -1,71 +1,124 @@
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 import numpy as np
+import threading
+import asyncio
 import base64
+import httpx
 import math
+import time
 import cv2
 
 from orbit.utils.sigmoid import calibrate_sigmoid 
+from orbit.utils import tracing
+from orbit.nsvs.vlm.encoding import ImageEncoder
+from orbit.nsvs.video.scene_change import evenly_spaced
+from orbit.nsvs.video.mosaic import tile_frames
+from orbit.nsvs.vlm.metrics import VLMMetrics
 from orbit.nsvs.vlm.obj import DetectedObject
 
 
+CAMERA_LETTERS = "ABCDEFGH" # single-token labels for camera mosaics
+MAX_MOSAIC_TILES = 16 # per grid image; more would shrink tiles past what the model can read
+
+
 class VLLMClient:
     def __init__(
         self,
         api_key="EMPTY",
         api_base="http://localhost:8000/v1",
         model="OpenGVLab/InternVL2_5-8B",
+        encoder: ImageEncoder | None = None,
+        mosaic: bool = False,
     ):
-        self.client = OpenAI(api_key=api_key, base_url=api_base)
+        self.client = self._make_client(api_key, api_base)
         self.model = model
+        self.encoder = encoder if encoder is not None else ImageEncoder.from_env()
+        self.mosaic = mosaic # send a window's frames as one labeled grid image instead of one image each
+        self.metrics = None # optional run-level VLMMetrics, recorded on every detect
 
-    def _encode_frame(self, frame):
-        # Encode a uint8 numpy array (image) as a JPEG and then base64 encode it.
-        ret, buffer = cv2.imencode(".jpg", frame)
-        if not ret:
-            raise ValueError("Could not encode frame")
-        return base64.b64encode(buffer).decode("utf-8")
+    def _make_client(self, api_key: str, api_base: str):
+        return OpenAI(api_key=api_key, base_url=api_base)
 
-    def detect(
-        self,
-        seq_of_frames: list[np.ndarray],
-        scene_description: str,
-        threshold: float
-    ) -> DetectedObject:
+    def _encode_frame(self, frame):
+        # Encode a uint8 numpy array (image) per the encoding policy and then base64 encode it.
+        return self.encoder.encode(frame)
 
+    def _build_messages(self, seq_of_frames: list[np.ndarray], scene_description: str) -> list[dict]:
         object_scene_description = scene_description.replace("_", " ")
         parsing_rule = "You must only return a Yes or No, and not both, to any question asked. You must not include any other symbols, information, text, justification in your answer or repeat Yes or No multiple times. For example, if the question is \"Is there a cat present in the sequence of images?\", the answer must only be 'Yes' or 'No'."
         prompt = rf"Is there a '{object_scene_description}' present in the sequence of images? " f"\n[PARSING RULE]: {parsing_rule}"
 
-        # Encode each frame.
-        encoded_images = [self._encode_frame(frame) for frame in seq_of_frames]
+        if self.mosaic and len(seq_of_frames) > 1:
+            # Grid images of up to MAX_MOSAIC_TILES tiles, labeled 1..N in temporal order, read left to right, top to bottom.
+            image_urls = []
+            for start in range(0, len(seq_of_frames), MAX_MOSAIC_TILES):
+                chunk = seq_of_frames[start:start + MAX_MOSAIC_TILES]
+                labels = [str(start + i + 1) for i in range(len(chunk))]
+                image_urls.append(self.encoder.data_url(tile_frames(chunk, labels=labels)))
+            grids = "image is a grid" if len(image_urls) == 1 else f"{len(image_urls)} images are grids"
+            intro = f"The following {grids} of {len(seq_of_frames)} frames from a sequence of images, labeled 1 to {len(seq_of_frames)} in temporal order (left to right, top to bottom)"
+        else:
+            # Encode each frame.
+            image_urls = self.encoder.data_urls(seq_of_frames)
+            intro = f"The following is the sequence of images"
 
-        # Build the user message: a text prompt plus one image for each frame.
+        # Build the user message: a text prompt plus the images.
         user_content = [
             {
                 "type": "text",
-                "text": f"The following is the sequence of images",
+                "text": intro,
             }
         ]
-        for encoded in encoded_images:
+        for image_url in image_urls:
             user_content.append(
                 {
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{encoded}"},
+                    "image_url": {"url": image_url},
                 }
             )
+        return [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": user_content},
+        ]
 
-        # Create a chat completion request.
-        chat_response = self.client.chat.completions.create(
+    def _request_kwargs(self, messages: list[dict]) -> dict:
+        return dict(
             model=self.model,
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": user_content},
-            ],
+            messages=messages,
             max_tokens=1,
             temperature=0.0,
             logprobs=True,
             top_logprobs=20,
         )
+
+    def _payload_bytes(self, messages: list[dict]) -> int:
+        size = 0
+        for message in messages:
+            content = message["content"]
+            if isinstance(content, str):
+                size += len(content)
+                continue
+            for part in content:
+                size += len(part["image_url"]["url"]) if part["type"] == "image_url" else len(part["text"])
+        return size
+
+    def _record(self, metrics, chat_response=None, **timings) -> None:
+        usage = getattr(chat_response, "usage", None)
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None)
+        record = dict(
+            timings,
+            prompt_tokens=getattr(usage, "prompt_tokens", None),
+            completion_tokens=getattr(usage, "completion_tokens", None),
+            cached_tokens=cached_tokens,
+            cache_hit=None if cached_tokens is None else cached_tokens > 0,
+            error=chat_response is None,
+        )
+        for m in (metrics, self.metrics):
+            if m is not None:
+                m.record(**record)
+
+    def _parse_detection(self, chat_response, scene_description: str, threshold: float) -> DetectedObject:
         content = chat_response.choices[0].message.content
         is_detected = "yes" in content.lower()
 
@@ -101,3 +154,292 @@ class VLLMClient:
             probability=round(probability, 3)
         )
 
+    def _build_camera_messages(self, multi_seq_of_frames: list[list[np.ndarray]], scene_description: str) -> list[dict]:
+        object_scene_description = scene_description.replace("_", " ")
+        letters = CAMERA_LETTERS[:len(multi_seq_of_frames)]
+        # keep the grid within MAX_MOSAIC_TILES by asking about fewer, evenly spread frames per camera
+        max_frames = max(1, MAX_MOSAIC_TILES // len(letters))
+        multi_seq_of_frames = [evenly_spaced(seq, max_frames) for seq in multi_seq_of_frames]
+        num_frames = max(len(seq) for seq in multi_seq_of_frames)
+        parsing_rule = f"You must only return a single camera letter ({', '.join(letters)}) or None, and nothing else. You must not include any other symbols, information, text, justification in your answer. For example, if the question is \"Which camera shows a cat?\" and only camera B shows one, the answer must only be 'B'."
+        prompt = rf"Which camera shows a '{object_scene_description}'? Answer with the letter of the camera where it is most clearly present, or None if no camera shows it. " f"\n[PARSING RULE]: {parsing_rule}"
+
+        # One row per camera, frames in temporal order left to right; tiles labeled <camera letter><frame number>
+        frames, labels = [], []
+        for letter, seq in zip(letters, multi_seq_of_frames):
+            for t in range(num_frames):
+                frames.append(seq[min(t, len(seq) - 1)])
+                labels.append(f"{letter}{t + 1}")
+        grid = tile_frames(frames, labels=labels, cols=num_frames)
+
+        intro = f"The following image is a grid of {len(letters)} cameras ({', '.join(letters)}), one camera per row, each row showing {num_frames} frames in temporal order from left to right"
+        return [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": [
+                {"type": "text", "text": intro},
+                {"type": "image_url", "image_url": {"url": self.encoder.data_url(grid)}},
+            ]},
+        ]
+
+    def _parse_camera_detection(self, chat_response, num_cameras: int, scene_description: str, threshold: float) -> tuple[int | None, DetectedObject]:
+        letters = CAMERA_LETTERS[:num_cameras]
+        content = chat_response.choices[0].message.content.strip()
+        top_logprobs_list = chat_response.choices[0].logprobs.content[0].top_logprobs
+
+        camera_probs = dict.fromkeys(letters, 0.0)
+        none_prob = 0.0
+        for top_logprob in top_logprobs_list:
+            token_text = top_logprob.token.strip()
+            if token_text in camera_probs:
+                camera_probs[token_text] += np.exp(top_logprob.logprob)
+            elif token_text in ("None", "No"):
+                none_prob += np.exp(top_logprob.logprob)
+
+        # P(some camera) / (P(some camera) + P(None)) plays the role of the Yes/No confidence
+        any_prob = sum(camera_probs.values())
+        if any_prob + none_prob > 0:
+            confidence = any_prob / (any_prob + none_prob)
+        else:
+            raise ValueError("No probabilities for a camera letter or 'None' found in the response.")
+        best_letter = max(letters, key=lambda letter: camera_probs[letter])
+        cam_index = letters.index(best_letter) if camera_probs[best_letter] > 0 else None
+
+        probability = calibrate_sigmoid(confidence=confidence, false_threshold=threshold)
+
+        return cam_index, DetectedObject(
+            name=scene_description,
+            is_detected=content in camera_probs,
+            confidence=round(confidence, 3),
+            probability=round(probability, 3)
+        )
+
+    def _create(self, messages: list[dict], metrics: VLMMetrics | None, timings: dict):
+        # Create a chat completion request.
+        start = time.perf_counter()
+        try:
+            chat_response = self.client.chat.completions.create(**self._request_kwargs(messages))
+        except Exception:
+            self._record(metrics, None, server_latency_s=time.perf_counter() - start, **timings)
+            raise
+        self._record(metrics, chat_response, server_latency_s=time.perf_counter() - start, **timings)
+        return chat_response
+
+    def detect(
+        self,
+        seq_of_frames: list[np.ndarray],
+        scene_description: str,
+        threshold: float,
+        metrics: VLMMetrics | None = None,
+        queue_wait: float | None = None,
+    ) -> DetectedObject:
+        with tracing.span("detect") as span:
+            if tracing.enabled(): # attributes are only built when they are written
+                span.set(proposition=scene_description, endpoint=str(self.client.base_url), queue_wait=queue_wait)
+            start = time.perf_counter()
+            messages = self._build_messages(seq_of_frames, scene_description)
+            timings = dict(
+                encode_s=time.perf_counter() - start,
+                payload_bytes=self._payload_bytes(messages),
+                queue_wait_s=queue_wait,
+            )
+            chat_response = self._create(messages, metrics, timings)
+            return self._parse_detection(chat_response, scene_description, threshold)
+
+    def detect_cameras(
+        self,
+        multi_seq_of_frames: list[list[np.ndarray]],
+        scene_description: str,
+        threshold: float,
+        metrics: VLMMetrics | None = None,
+        queue_wait: float | None = None,
+    ) -> tuple[int | None, DetectedObject]:
+        """Ask once, over a mosaic of every camera, which camera shows the proposition.
+
+        Returns the index of the most likely camera (None if no camera letter had any probability)
+        and a DetectedObject whose confidence is P(any camera) against P(None).
+        """
+        if len(multi_seq_of_frames) > len(CAMERA_LETTERS):
+            raise ValueError(f"At most {len(CAMERA_LETTERS)} cameras fit in one mosaic")
+        with tracing.span("detect_cameras") as span:
+            if tracing.enabled():
+                span.set(proposition=scene_description, endpoint=str(self.client.base_url), queue_wait=queue_wait)
+            start = time.perf_counter()
+            messages = self._build_camera_messages(multi_seq_of_frames, scene_description)
+            timings = dict(
+                encode_s=time.perf_counter() - start,
+                payload_bytes=self._payload_bytes(messages),
+                queue_wait_s=queue_wait,
+            )
+            chat_response = self._create(messages, metrics, timings)
+            return self._parse_camera_detection(chat_response, len(multi_seq_of_frames), scene_description, threshold)
+
+
+class AsyncVLLMClient(VLLMClient):
+    """VLLMClient on AsyncOpenAI with a keep-alive connection pool and at most `max_concurrency` requests in flight."""
+    def __init__(
+        self,
+        api_key="EMPTY",
+        api_base="http://localhost:8000/v1",
+        model="OpenGVLab/InternVL2_5-8B",
+        encoder: ImageEncoder | None = None,
+        mosaic: bool = False,
+        max_concurrency: int = 64,
+        timeout: float = 120.0,
+    ):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        super().__init__(api_key=api_key, api_base=api_base, model=model, encoder=encoder, mosaic=mosaic)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def _make_client(self, api_key: str, api_base: str):
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+            timeout=self.timeout,
+        )
+        return AsyncOpenAI(api_key=api_key, base_url=api_base, http_client=self.http_client)
+
+    async def _create(self, messages: list[dict], metrics: VLMMetrics | None, timings: dict):
+        start = time.perf_counter()
+        async with self._semaphore:
+            # time spent waiting for a slot counts as queueing, on top of any wait before this client
+            timings["queue_wait_s"] = (timings.get("queue_wait_s") or 0.0) + time.perf_counter() - start
+            start = time.perf_counter()
+            try:
+                chat_response = await self.client.chat.completions.create(**self._request_kwargs(messages))
+            except Exception:
+                self._record(metrics, None, server_latency_s=time.perf_counter() - start, **timings)
+                raise
+        self._record(metrics, chat_response, server_latency_s=time.perf_counter() - start, **timings)
+        return chat_response
+
+    async def detect(
+        self,
+        seq_of_frames: list[np.ndarray],
+        scene_description: str,
+        threshold: float,
+        metrics: VLMMetrics | None = None,
+        queue_wait: float | None = None,
+    ) -> DetectedObject:
+        with tracing.span("detect") as span:
+            if tracing.enabled():
+                span.set(proposition=scene_description, endpoint=str(self.client.base_url), queue_wait=queue_wait)
+            # JPEG encoding releases the GIL, keep it off the event loop
+            start = time.perf_counter()
+            messages = await asyncio.to_thread(self._build_messages, seq_of_frames, scene_description)
+            timings = dict(
+                encode_s=time.perf_counter() - start,
+                payload_bytes=self._payload_bytes(messages),
+                queue_wait_s=queue_wait,
+            )
+            chat_response = await self._create(messages, metrics, timings)
+            return self._parse_detection(chat_response, scene_description, threshold)
+
+    async def detect_cameras(
+        self,
+        multi_seq_of_frames: list[list[np.ndarray]],
+        scene_description: str,
+        threshold: float,
+        metrics: VLMMetrics | None = None,
+        queue_wait: float | None = None,
+    ) -> tuple[int | None, DetectedObject]:
+        """VLLMClient.detect_cameras, awaited"""
+        if len(multi_seq_of_frames) > len(CAMERA_LETTERS):
+            raise ValueError(f"At most {len(CAMERA_LETTERS)} cameras fit in one mosaic")
+        with tracing.span("detect_cameras") as span:
+            if tracing.enabled():
+                span.set(proposition=scene_description, endpoint=str(self.client.base_url), queue_wait=queue_wait)
+            start = time.perf_counter()
+            messages = await asyncio.to_thread(self._build_camera_messages, multi_seq_of_frames, scene_description)
+            timings = dict(
+                encode_s=time.perf_counter() - start,
+                payload_bytes=self._payload_bytes(messages),
+                queue_wait_s=queue_wait,
+            )
+            chat_response = await self._create(messages, metrics, timings)
+            return self._parse_camera_detection(chat_response, len(multi_seq_of_frames), scene_description, threshold)
+
+    async def _run_request(self, request: dict, method: str):
+        request = dict(request)
+        trace = request.pop("trace", None) # span attributes for this request, as VLLMRouter.detect_many takes them
+        with tracing.context(**(trace or {})):
+            return await getattr(self, method)(**request)
+
+    async def detect_many(self, requests: list[dict], method: str = "detect", return_exceptions: bool = False) -> list:
+        """Run detect (or detect_cameras) for each kwargs dict in requests concurrently; results in request order"""
+        return await asyncio.gather(
+            *(self._run_request(request, method) for request in requests),
+            return_exceptions=return_exceptions,
+        )
+
+    async def aclose(self) -> None:
+        await self.http_client.aclose()
+
+
+class SyncVLLMClient:
+    """Blocking facade over AsyncVLLMClient for existing callers; the client lives on a private event loop thread.
+
+    Takes the AsyncVLLMClient arguments and has VLLMClient's detect/detect_cameras signatures, so
+    many threads can share one connection pool and concurrency limit.
+    """
+    def __init__(self, **kwargs):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True, name="vllm-client-loop")
+        self._thread.start()
+        self.async_client = self._run(self._create_client(**kwargs)) # the semaphore and pool belong to this loop
+
+    async def _create_client(self, **kwargs) -> AsyncVLLMClient:
+        return AsyncVLLMClient(**kwargs)
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    @property
+    def model(self) -> str:
+        return self.async_client.model
+
+    @property
+    def metrics(self) -> VLMMetrics | None:
+        return self.async_client.metrics
+
+    @metrics.setter
+    def metrics(self, metrics: VLMMetrics | None) -> None:
+        self.async_client.metrics = metrics
+
+    def detect(
+        self,
+        seq_of_frames: list[np.ndarray],
+        scene_description: str,
+        threshold: float,
+        metrics: VLMMetrics | None = None,
+        queue_wait: float | None = None,
+    ) -> DetectedObject:
+        return self._run(self._traced(self.async_client.detect(seq_of_frames, scene_description, threshold, metrics=metrics, queue_wait=queue_wait)))
+
+    def detect_cameras(
+        self,
+        multi_seq_of_frames: list[list[np.ndarray]],
+        scene_description: str,
+        threshold: float,
+        metrics: VLMMetrics | None = None,
+        queue_wait: float | None = None,
+    ) -> tuple[int | None, DetectedObject]:
+        return self._run(self._traced(self.async_client.detect_cameras(multi_seq_of_frames, scene_description, threshold, metrics=metrics, queue_wait=queue_wait)))
+
+    def detect_many(self, requests: list[dict], method: str = "detect", return_exceptions: bool = False) -> list:
+        return self._run(self._traced(self.async_client.detect_many(requests, method=method, return_exceptions=return_exceptions)))
+
+    def _traced(self, coro):
+        # the loop thread has its own context; carry the caller's trace attributes over to it
+        if not tracing.enabled():
+            return coro
+        attrs = tracing.attributes()
+        async def run():
+            with tracing.context(**attrs):
+                return await coro
+        return run()
+
+    def close(self) -> None:
+        self._run(self.async_client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
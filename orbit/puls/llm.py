@@ -37,7 +37,7 @@ class LLM:
         else:
             filename = "conversation_history_target.json"
 
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f") # microseconds: concurrent entries save in the same second
         base_name, extension = os.path.splitext(filename)
         timestamped_filename = f"{base_name}_{timestamp}{extension}"
 
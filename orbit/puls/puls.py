@@ -1,5 +1,6 @@
 from orbit.puls.llm import *
 from orbit.puls.prompts import *
+from orbit.utils import tracing
 import json
 import os
 import re
@@ -45,6 +46,7 @@ def process_specification(specification, propositions):
 
     return new_propositions, specification
 
+@tracing.traced("PULS")
 def PULS(prompt, openai_key=None):
     if openai_key:
         os.environ["OPENAI_API_KEY"] = openai_key
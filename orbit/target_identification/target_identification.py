@@ -1,4 +1,5 @@
 from orbit.puls.llm import LLM
+from orbit.utils import tracing
 import json
 
 def clean_and_parse_json(raw_str):
@@ -65,6 +66,7 @@ Expected Output (only output the following JSON structure — nothing else):
     }
 
 
+@tracing.traced("identify_target")
 def identify_target(question, candidates, specification, conversation_history):
     # Read the conversation history
     history_path = conversation_history
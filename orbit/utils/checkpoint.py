@@ -0,0 +1,138 @@
+import threading
+import tempfile
+import hashlib
+import glob
+import json
+import time
+import os
+
+
+def config_hash(config: dict) -> str:
+    """Short stable hash of everything a run's results depend on"""
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+class JsonlCheckpoint:
+    """Append-only JSONL log of finished entries, safe to kill at any point.
+
+    Each line is {"key", "config", "entry"}. Lines are flushed as written and fsynced every
+    `fsync_every` records or `fsync_interval` seconds, whichever comes first, so a crash loses at
+    most that batch. `load` skips a torn last line and records written under another config;
+    `compact` writes the final JSON atomically.
+    """
+    def __init__(self, path: str, config: str, fsync_every: int = 8, fsync_interval: float = 5.0):
+        self.path = path
+        self.config = config
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def load(self) -> dict:
+        """key -> entry for every complete record of this config (the last one wins)"""
+        return load_checkpoints([self.path], self.config)
+
+    def append(self, key: str, entry: dict) -> None:
+        line = json.dumps({"key": key, "config": self.config, "entry": entry}) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a+b")
+                if self._file.tell() > 0:
+                    self._file.seek(-1, os.SEEK_END)
+                    if self._file.read(1) != b"\n":
+                        self._file.write(b"\n") # terminate a torn last line so this record stays parseable
+            self._file.write(line.encode("utf-8"))
+            self._file.flush()
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync()
+
+    def sync(self) -> None:
+        """fsync every record appended so far, e.g. before telling other workers they are done"""
+        with self._lock:
+            if self._file is not None and self._unsynced:
+                self._sync()
+
+    def _sync(self) -> None:
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+
+    def compact(self, output_path: str, keys: list[str]) -> list[dict]:
+        """Write the entries for `keys`, in that order, as the final JSON; returns them"""
+        self.close()
+        return compact_checkpoints([self.path], self.config, output_path, keys)
+
+
+def load_checkpoints(paths: list[str], config: str) -> dict:
+    """key -> entry over several checkpoint files (e.g. one per worker), skipping torn lines"""
+    completed = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue # torn write from a crash
+                if record.get("config") == config:
+                    completed[record["key"]] = record["entry"]
+    return completed
+
+class CheckpointKeys:
+    """Keys finished under `config` across checkpoint files matching a glob, read incrementally.
+
+    `refresh` picks up new files and reads only the complete lines appended since the last call,
+    so polling it once per claimed item stays cheap as the checkpoints grow.
+    """
+    def __init__(self, pattern: str, config: str):
+        self.pattern = pattern
+        self.config = config
+        self.keys = set()
+        self._offsets = {}
+
+    def refresh(self) -> set:
+        for path in glob.glob(self.pattern):
+            offset = self._offsets.get(path, 0)
+            if os.path.getsize(path) <= offset:
+                continue
+            with open(path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+            end = data.rfind(b"\n") + 1 # leave a line still being written for the next refresh
+            for line in data[:end].splitlines():
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue # torn write from a crash
+                if record.get("config") == self.config:
+                    self.keys.add(record["key"])
+            self._offsets[path] = offset + end
+        return self.keys
+
+def compact_checkpoints(paths: list[str], config: str, output_path: str, keys: list[str]) -> list[dict]:
+    completed = load_checkpoints(paths, config)
+    output = [completed[key] for key in keys if key in completed]
+    # unique tmp file, so concurrent compactions of the same output never share one
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output_path)), prefix=f".{os.path.basename(output_path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(output, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return output
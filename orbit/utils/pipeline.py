@@ -0,0 +1,48 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+
+
+class StageScheduler:
+    """Runs tasks on a bounded thread pool per stage type, each once the tasks it depends on finish.
+
+    `submit(stage, fn, ..., after=[futures])` returns a Future right away; fn is queued on that
+    stage's pool only when every future in `after` has succeeded. If one fails, the task fails
+    with the same exception without running. Futures in `settled` only have to finish, so a
+    failed one still releases the task. Stages therefore overlap across entries while each
+    entry's own steps keep their order.
+    """
+    def __init__(self, workers: dict[str, int]):
+        self.pools = {stage: ThreadPoolExecutor(max_workers=n, thread_name_prefix=stage) for stage, n in workers.items()}
+
+    def submit(self, stage: str, fn, *args, after: list[Future] = (), settled: list[Future] = (), **kwargs) -> Future:
+        future = Future()
+        pool = self.pools[stage]
+
+        def launch():
+            for dependency in after:
+                if dependency.exception() is not None:
+                    future.set_exception(dependency.exception())
+                    return
+            inner = pool.submit(fn, *args, **kwargs)
+            inner.add_done_callback(lambda f: future.set_exception(f.exception()) if f.exception() is not None else future.set_result(f.result()))
+
+        dependencies = list(after) + list(settled)
+        remaining = [len(dependencies)]
+        lock = threading.Lock()
+
+        def on_done(_):
+            with lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                launch()
+
+        if not dependencies:
+            launch()
+        for dependency in dependencies:
+            dependency.add_done_callback(on_done)
+        return future
+
+    def shutdown(self, wait: bool = True) -> None:
+        for pool in self.pools.values():
+            pool.shutdown(wait=wait)
@@ -0,0 +1,220 @@
+"""Opt-in sampling profiler around chosen pipeline stages.
+
+ORBIT_PROFILE=detect,frame (or a script's --profile) selects stages by name, "all" selects every
+stage; ORBIT_PROFILE_ENTRIES=10:20 (--profile-entries) limits them to those entry indices. Each
+selected `stage` block samples the stack of the thread that entered it every
+ORBIT_PROFILE_INTERVAL seconds (default 0.005) and writes ORBIT_PROFILE_DIR/<stage>_<entry>.folded,
+collapsed stacks for flamegraph.pl or speedscope, or .speedscope.json with
+ORBIT_PROFILE_FORMAT=speedscope. Unselected stages cost one set lookup.
+
+Work the stage hands to a thread pool is only sampled if submitted through `follow` (as the VLM
+router does); the pool thread is then sampled alongside the stage's own thread while it runs that
+task. Other threads, including pools that don't use `follow`, are not in the profile.
+
+    with profiling.stage("detect", entry=entry["video_id"], index=i):
+        ...
+"""
+from collections import Counter
+import contextvars
+import functools
+import threading
+import json
+import time
+import sys
+import os
+import re
+
+
+FORMATS = {"collapsed": ".folded", "speedscope": ".speedscope.json"}
+
+_stages = set()
+_entries = None
+_output_dir = "profiles"
+_format = "collapsed"
+_interval = 0.005
+_lock = threading.Lock()
+_active = contextvars.ContextVar("orbit_profile_sampler", default=None)
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+
+class StackSampler:
+    """Samples the Python stacks of the entering thread (and threads running work it handed to
+    `follow`) on a background thread until the block exits."""
+    def __init__(self, stage: str, label: str, interval: float):
+        self.stage = stage
+        self.label = label
+        self.interval = interval
+        self.counts = Counter()
+        self.ticks = 0
+        self.followed = Counter() # thread id -> tasks of this stage it is running
+        self._followed_lock = threading.Lock()
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        self._token = _active.set(self)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True, name=f"profile-{self.stage}")
+        self.start = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            with self._followed_lock:
+                thread_ids = {self.thread_id, *self.followed}
+            frames = sys._current_frames()
+            self.ticks += 1
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_qualname, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                if stack:
+                    self.counts[tuple(reversed(stack))] += 1
+
+    def run_followed(self, fn, *args, **kwargs):
+        thread_id = threading.get_ident()
+        with self._followed_lock:
+            self.followed[thread_id] += 1
+        token = _active.set(self) # work this task hands on is followed too
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _active.reset(token)
+            with self._followed_lock:
+                self.followed[thread_id] -= 1
+                if not self.followed[thread_id]:
+                    del self.followed[thread_id]
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        _active.reset(self._token)
+        self.duration = time.perf_counter() - self.start
+        if self.counts:
+            path = self.save(_output_dir, _format)
+            print(f"Profiled {self.stage} {self.label}: {sum(self.counts.values())} samples over {self.duration:.2f}s -> {path}")
+        return False
+
+    def collapsed(self) -> str:
+        lines = []
+        for stack, count in self.counts.most_common():
+            lines.append(";".join(f"{name} ({os.path.basename(file)}:{line})" for name, file, line in stack) + f" {count}")
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self) -> dict:
+        frames, frame_index, samples = [], {}, []
+        for stack in self.counts:
+            sample = []
+            for name, file, line in stack:
+                if (name, file, line) not in frame_index:
+                    frame_index[(name, file, line)] = len(frames)
+                    frames.append({"name": name, "file": file, "line": line})
+                sample.append(frame_index[(name, file, line)])
+            samples.append(sample)
+        seconds_per_sample = self.duration / max(self.ticks, 1) # followed threads add samples per tick
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.stage} {self.label}",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"{self.stage} {self.label}",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": seconds_per_sample * sum(self.counts.values()),
+                "samples": samples,
+                "weights": [count * seconds_per_sample for count in self.counts.values()],
+            }],
+        }
+
+    def save(self, output_dir: str, fmt: str = "collapsed") -> str:
+        os.makedirs(output_dir, exist_ok=True)
+        stem = os.path.join(output_dir, re.sub(r"[^A-Za-z0-9_.-]+", "_", f"{self.stage}_{self.label}"))
+        with _lock: # a stage that runs twice for one entry (e.g. a retry) keeps both profiles
+            path, n = f"{stem}{FORMATS[fmt]}", 1
+            while os.path.exists(path):
+                path, n = f"{stem}_{n}{FORMATS[fmt]}", n + 1
+            with open(path, "w") as f:
+                if fmt == "speedscope":
+                    json.dump(self.speedscope(), f)
+                else:
+                    f.write(self.collapsed())
+        return path
+
+
+def parse_entries(text: str | None) -> range | None:
+    """'10:20' / '10-20' -> range(10, 20), '7' -> range(7, 8)"""
+    if not text:
+        return None
+    match = re.fullmatch(r"\s*(\d*)\s*[:-]\s*(\d*)\s*", text)
+    if match:
+        return range(int(match[1] or 0), int(match[2]) if match[2] else sys.maxsize)
+    return range(int(text), int(text) + 1)
+
+def configure(
+    stages: str | list[str] | None,
+    entries: str | range | None = None,
+    output_dir: str = "profiles",
+    fmt: str = "collapsed",
+    interval: float = 0.005,
+) -> None:
+    """Profile `stages` (None or empty turns profiling off)"""
+    global _stages, _entries, _output_dir, _format, _interval
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown profile format {fmt!r}, expected one of {list(FORMATS)}")
+    if isinstance(stages, str):
+        stages = [stage.strip() for stage in stages.split(",") if stage.strip()]
+    _stages = set(stages or [])
+    _entries = parse_entries(entries) if isinstance(entries, str) else entries
+    _output_dir = output_dir
+    _format = fmt
+    _interval = interval
+
+def stage(name: str, entry=None, index: int | None = None):
+    """Profile this block if stage `name` (and entry `index`, when a range is set) is selected"""
+    if name not in _stages and "all" not in _stages:
+        return _NULL_STAGE
+    if _entries is not None and (index is None or index not in _entries):
+        return _NULL_STAGE
+    return StackSampler(name, str(entry if entry is not None else index), _interval)
+
+def follow(fn):
+    """Bind fn to the stage being profiled here, for handing work to a thread pool"""
+    sampler = _active.get()
+    if sampler is None:
+        return fn
+    return functools.partial(sampler.run_followed, fn)
+
+def add_arguments(parser) -> None:
+    """--profile* options mirroring the ORBIT_PROFILE* variables"""
+    parser.add_argument("--profile", default=None, help="comma-separated stages to profile, or 'all'")
+    parser.add_argument("--profile-entries", default=None, help="entry index range to profile, e.g. 10:20")
+    parser.add_argument("--profile-dir", default="profiles")
+    parser.add_argument("--profile-format", default="collapsed", choices=list(FORMATS))
+    parser.add_argument("--profile-interval", type=float, default=0.005, help="seconds between samples")
+
+def configure_from_args(args) -> None:
+    if args.profile:
+        configure(args.profile, args.profile_entries, args.profile_dir, args.profile_format, args.profile_interval)
+
+
+if os.environ.get("ORBIT_PROFILE"):
+    configure(
+        os.environ["ORBIT_PROFILE"],
+        os.environ.get("ORBIT_PROFILE_ENTRIES"),
+        os.environ.get("ORBIT_PROFILE_DIR", "profiles"),
+        os.environ.get("ORBIT_PROFILE_FORMAT", "collapsed"),
+        float(os.environ.get("ORBIT_PROFILE_INTERVAL", 0.005)),
+    )
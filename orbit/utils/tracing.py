@@ -0,0 +1,174 @@
+"""Process-wide timing spans for the ORBIT pipeline.
+
+Off unless ORBIT_TRACE names an output file (or `configure` is called); while off, `span` and
+`traced` cost one global check. A `.json` path gets a Chrome trace (chrome://tracing, Perfetto),
+anything else JSONL with one span per line. Attributes set with `context` (entry, window, ...)
+are attached to every span opened inside it, including in threads started through
+`propagate`. Worker processes write next to the parent's file, as `<name>.<pid><ext>`.
+
+    with tracing.context(entry=entry["video_id"]):
+        with tracing.span("read_video", path=path):
+            ...
+"""
+import multiprocessing
+import contextvars
+import functools
+import threading
+import atexit
+import json
+import time
+import os
+
+
+_writer = None
+_context = contextvars.ContextVar("orbit_trace_context", default={})
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs) -> None:
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+
+class _TraceWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self.chrome = path.endswith(".json")
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._file = open(path, "w", buffering=1) # spans are coarse; line buffering keeps a killed run's trace
+        if self.chrome:
+            self._file.write("[\n") # Chrome tolerates the missing closing bracket of a killed run
+        atexit.register(self.close)
+
+    def write(self, name: str, start: float, duration: float, attrs: dict) -> None:
+        if self.chrome:
+            event = {
+                "name": name,
+                "ph": "X",
+                "ts": start * 1e6,
+                "dur": duration * 1e6,
+                "pid": self.pid,
+                "tid": threading.get_ident(),
+                "args": attrs,
+            }
+            line = json.dumps(event, default=str) + ",\n"
+        else:
+            line = json.dumps({"name": name, "start": start, "duration": duration, "pid": self.pid, "thread": threading.get_ident(), **attrs}, default=str) + "\n"
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line)
+
+    def close(self) -> None:
+        if os.getpid() != self.pid:
+            return # inherited through fork; the parent closes it
+        with self._lock:
+            if not self._file.closed:
+                if self.chrome:
+                    self._file.write("{}]\n")
+                self._file.close()
+
+
+def _process_path(path: str) -> str:
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{os.getpid()}{ext}"
+
+
+class Span:
+    __slots__ = ("name", "attrs", "start")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.time() - self.start
+        attrs = {**_context.get(), **self.attrs}
+        if exc_type is not None:
+            attrs["error"] = repr(exc)
+        writer = _writer
+        if writer is not None:
+            writer.write(self.name, self.start, duration, attrs)
+        return False
+
+    def set(self, **attrs) -> None:
+        """Attach attributes known only once the span is running"""
+        self.attrs.update(attrs)
+
+
+def configure(path: str | None) -> None:
+    """Start writing spans to `path` (None stops tracing)"""
+    global _writer
+    if _writer is not None:
+        _writer.close()
+    _writer = _TraceWriter(path) if path else None
+
+def _after_fork_in_child() -> None:
+    global _writer
+    if _writer is not None: # leave the parent's file to the parent
+        _writer = _TraceWriter(_process_path(_writer.path))
+
+def enabled() -> bool:
+    return _writer is not None
+
+def attributes() -> dict:
+    """Attributes the enclosing `context` blocks add to spans, for carrying them to another thread or event loop"""
+    return _context.get()
+
+def span(name: str, **attrs):
+    if _writer is None:
+        return _NULL_SPAN
+    return Span(name, attrs)
+
+def traced(name: str | None = None):
+    """Decorator form of span"""
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _writer is None:
+                return fn(*args, **kwargs)
+            with Span(span_name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class context:
+    """Add attributes to every span opened in this block (and in work it hands to `propagate`)"""
+    def __init__(self, **attrs):
+        self.attrs = attrs
+        self.token = None
+
+    def __enter__(self):
+        if _writer is not None:
+            self.token = _context.set({**_context.get(), **self.attrs})
+        return self
+
+    def __exit__(self, *exc):
+        if self.token is not None:
+            _context.reset(self.token)
+        return False
+
+def propagate(fn):
+    """Bind fn to the current trace context, for handing work to a thread pool"""
+    if _writer is None:
+        return fn
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+if os.environ.get("ORBIT_TRACE"):
+    # spawned worker processes import this module again; don't let them truncate the parent's file
+    configure(os.environ["ORBIT_TRACE"] if multiprocessing.parent_process() is None else _process_path(os.environ["ORBIT_TRACE"]))
@@ -0,0 +1,157 @@
+import contextlib
+import threading
+import sqlite3
+import socket
+import json
+import time
+import os
+
+
+class WorkQueue:
+    """SQLite-backed queue that any number of worker processes claim items from.
+
+    A claim leases an item for `lease_seconds`; the holder keeps it alive with `heartbeat`. Items
+    whose lease ran out (a dead or stuck worker) are handed to the next claimer. Failed items go
+    back to the queue until they have been tried `max_attempts` times.
+
+    The default rollback journal works on shared network filesystems such as /nas (given working
+    POSIX locks); `wal=True` is faster but only safe when every worker is on the same host and the
+    file is on a local disk.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS items (
+            key TEXT PRIMARY KEY,
+            position INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            worker TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT
+        )
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 600.0, max_attempts: int = 3, wal: bool = False):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with self._connect() as conn:
+            conn.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+            conn.execute(self.SCHEMA)
+            conn.execute("CREATE TABLE IF NOT EXISTS elections (name TEXT PRIMARY KEY, worker TEXT NOT NULL)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # one short-lived connection per call, so the queue can be shared between threads
+        conn = sqlite3.connect(self.path, timeout=60.0, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close() # rolls back a transaction left open by an exception
+
+    def enqueue(self, items: list[tuple[str, object]]) -> None:
+        """Add (key, payload) items in order; keys already in the queue are left untouched"""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR IGNORE INTO items (key, position, payload) VALUES (?, ?, ?)",
+                [(key, position, json.dumps(payload)) for position, (key, payload) in enumerate(items)],
+            )
+            conn.execute("COMMIT")
+
+    def claim(self, worker: str) -> tuple[str, object] | None:
+        """Lease the next pending (or expired) item to `worker`; None if nothing is claimable right now"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT key, payload, status, worker FROM items "
+                "WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) "
+                "ORDER BY position LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            key, payload, status, previous_worker = row
+            conn.execute(
+                "UPDATE items SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE key = ?",
+                (worker, now + self.lease_seconds, key),
+            )
+            conn.execute("COMMIT")
+        if status == "leased":
+            print(f"Reclaimed {key} from {previous_worker} (lease expired)")
+        return key, json.loads(payload)
+
+    def heartbeat(self, worker: str, keys: list[str]) -> None:
+        if not keys:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE items SET lease_expires = ? WHERE key = ? AND worker = ? AND status = 'leased'",
+                [(time.time() + self.lease_seconds, key, worker) for key in keys],
+            )
+
+    def complete(self, worker: str, key: str) -> None:
+        with self._connect() as conn:
+            conn.execute("UPDATE items SET status = 'done', lease_expires = NULL, error = NULL WHERE key = ? AND worker = ?", (key, worker))
+
+    def fail(self, worker: str, key: str, error: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE items SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "lease_expires = NULL, error = ? WHERE key = ? AND worker = ?",
+                (self.max_attempts, error, key, worker),
+            )
+
+    def elect(self, name: str, worker: str) -> bool:
+        """True for exactly one worker per `name` (the first to ask), e.g. to pick a single compactor"""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR IGNORE INTO elections (name, worker) VALUES (?, ?)", (name, worker))
+            winner = conn.execute("SELECT worker FROM elections WHERE name = ?", (name,)).fetchone()[0]
+            conn.execute("COMMIT")
+        return winner == worker
+
+    def counts(self) -> dict[str, int]:
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall())
+
+    def unfinished(self) -> int:
+        """Items still pending or leased (by anyone)"""
+        counts = self.counts()
+        return counts.get("pending", 0) + counts.get("leased", 0)
+
+
+class LeaseKeeper:
+    """Background heartbeat for the items a worker currently holds."""
+    def __init__(self, queue: WorkQueue, worker: str):
+        self.queue = queue
+        self.worker = worker
+        self.keys = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def add(self, key: str) -> None:
+        with self._lock:
+            self.keys.add(key)
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            self.keys.discard(key)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            with self._lock:
+                keys = list(self.keys)
+            self.queue.heartbeat(self.worker, keys)
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
@@ -0,0 +1,98 @@
+"""Compare adaptive camera selection in run_nsvs against asking every camera.
+
+Runs run_nsvs twice on each sampled multi-camera entry of an ORBIT output file (which already has
+PULS propositions and specifications): once exhaustively and once with adaptive_cameras. Reports
+the VLM requests each mode sent, the requests adaptive mode saved, and how often its final
+detections and frames of interest differ from exhaustive mode.
+
+    python scripts/benchmark_camera_selection.py --orbit-output /nas/.../ego_exo4d.json \
+        --api-base http://localhost:8000/v1 --fanout-threshold 0.5 --sweep-interval 10
+"""
+from pathlib import Path
+import argparse
+import random
+import json
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from orbit.nsvs.video.read_video import Mp4Reader
+from orbit.nsvs.vlm.router import VLLMRouter
+from orbit.nsvs.nsvs import run_nsvs
+
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+def run_mode(entry, multi_video_data, vlm, args, adaptive: bool) -> dict:
+    foi, all_detections, metrics = run_nsvs(
+        multi_video_data,
+        entry["video_paths"],
+        entry["puls"]["proposition"],
+        entry["puls"]["specification"],
+        model_name=args.model,
+        device=0,
+        vlm=vlm,
+        adaptive_cameras=adaptive,
+        camera_fanout_threshold=args.fanout_threshold,
+        camera_sweep_interval=args.sweep_interval,
+    )
+    return {
+        "foi": set(foi.keys()),
+        "detections": set().union(*[set(s) for s in all_detections]),
+        "requests": metrics["counters"]["requests"],
+        "requests_saved": metrics["counters"].get("requests_saved", 0),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orbit-output", default="/nas/mars/experiment_result/orbit/2_full_output/ego_exo4d.json")
+    parser.add_argument("--api-base", nargs="+", default=["http://localhost:8000/v1"])
+    parser.add_argument("--model", default="OpenGVLab/InternVL3_5-14B")
+    parser.add_argument("--num-entries", type=int, default=20)
+    parser.add_argument("--fanout-threshold", type=float, default=0.5)
+    parser.add_argument("--sweep-interval", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="camera_selection_benchmark.json")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with open(args.orbit_output, "r") as f:
+        entries = [e for e in json.load(f) if len(e.get("video_paths", [])) > 1 and e.get("puls", {}).get("proposition")]
+    entries = rng.sample(entries, min(args.num_entries, len(entries)))
+
+    vlm = VLLMRouter(args.api_base, model=args.model)
+    results = []
+    for i, entry in enumerate(entries):
+        multi_video_data = [Mp4Reader(path=video_path, sample_rate=1).read_video() for video_path in entry["video_paths"]]
+        exhaustive = run_mode(entry, multi_video_data, vlm, args, adaptive=False)
+        adaptive = run_mode(entry, multi_video_data, vlm, args, adaptive=True)
+        result = {
+            "video_id": entry.get("video_id"),
+            "num_cameras": len(entry["video_paths"]),
+            "exhaustive_requests": exhaustive["requests"],
+            "adaptive_requests": adaptive["requests"],
+            "requests_saved": adaptive["requests_saved"],
+            "detections_jaccard": jaccard(exhaustive["detections"], adaptive["detections"]),
+            "detections_differ": exhaustive["detections"] != adaptive["detections"],
+            "foi_differ": exhaustive["foi"] != adaptive["foi"],
+        }
+        results.append(result)
+        print(
+            f"[{i + 1}/{len(entries)}] {result['exhaustive_requests']} -> {result['adaptive_requests']} requests  "
+            f"detections jaccard={result['detections_jaccard']:.3f}  foi differ={result['foi_differ']}"
+        )
+    vlm.close()
+
+    if results:
+        exhaustive_total = sum(r["exhaustive_requests"] for r in results)
+        adaptive_total = sum(r["adaptive_requests"] for r in results)
+        print(f"requests: {exhaustive_total} -> {adaptive_total} ({1 - adaptive_total / max(exhaustive_total, 1):.1%} saved)")
+        print(f"entries with different detections: {sum(r['detections_differ'] for r in results) / len(results):.1%}")
+        print(f"entries with different frames of interest: {sum(r['foi_differ'] for r in results) / len(results):.1%}")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"Saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
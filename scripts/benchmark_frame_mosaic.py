@@ -0,0 +1,69 @@
+"""Compare per-frame requests with frame-mosaic requests (one tiled image per window).
+
+Same window sampling as benchmark_image_encoding.py; reports prompt tokens, payload, latency and
+throughput for both modes, and how often the mosaic answer agrees with the per-frame answer.
+
+    python scripts/benchmark_frame_mosaic.py --orbit-output /nas/.../ego_exo4d.json --api-base http://localhost:8000/v1
+"""
+from pathlib import Path
+import argparse
+import random
+import json
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from benchmark_image_encoding import sample_windows, measure_policy, compare
+from orbit.nsvs.vlm.vllm_client import VLLMClient
+from orbit.nsvs.vlm.encoding import ImageEncoder
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orbit-output", default="/nas/mars/experiment_result/orbit/2_full_output/ego_exo4d.json")
+    parser.add_argument("--api-base", default="http://localhost:8000/v1")
+    parser.add_argument("--model", default="OpenGVLab/InternVL3_5-14B")
+    parser.add_argument("--num-entries", type=int, default=20)
+    parser.add_argument("--windows-per-entry", type=int, default=3)
+    parser.add_argument("--frames-per-window", type=int, default=3)
+    parser.add_argument("--frame-step", type=int, default=30)
+    parser.add_argument("--vlm-detection-threshold", type=float, default=0.349)
+    parser.add_argument("--detection-threshold", type=float, default=0.5)
+    parser.add_argument("--num-workers", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="frame_mosaic_benchmark.json")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with open(args.orbit_output, "r") as f:
+        entries = json.load(f)
+    entries = rng.sample(entries, min(args.num_entries, len(entries)))
+    windows = sample_windows(entries, args.windows_per_entry, args.frames_per_window, args.frame_step, rng)
+    print(f"{len(windows)} windows, {sum(len(p) for _, p in windows)} requests per mode")
+
+    results = {}
+    detections = {}
+    for mode, mosaic in [("per_frame", False), ("mosaic", True)]:
+        client = VLLMClient(api_base=args.api_base, model=args.model, encoder=ImageEncoder.from_env(), mosaic=mosaic)
+        measured = measure_policy(client, windows, args.vlm_detection_threshold, args.num_workers)
+        detections[mode] = measured.pop("detections")
+        results[mode] = measured
+    results["agreement"] = compare(detections["per_frame"], detections["mosaic"], args.detection_threshold)
+
+    for mode in ["per_frame", "mosaic"]:
+        r = results[mode]
+        print(
+            f"{mode:10s} {r['prompt_tokens_mean'] or 0:8.1f} prompt tokens  {r['payload_kb_per_request']:8.1f} KB  "
+            f"latency {r['server_latency_s_mean'] or 0:.3f}s (p90 {r['server_latency_s_p90'] or 0:.3f}s)  {r['requests_per_s'] or 0:6.1f} req/s"
+        )
+    agreement = results["agreement"]
+    print(
+        f"agreement: dconf={agreement['mean_abs_confidence_delta']:.3f}  is_detected flips={agreement['is_detected_flip_rate']:.2%}  "
+        f"threshold flips={agreement['threshold_flip_rate']:.2%}"
+    )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"Saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Measure payload size, encode time and detection drift of image encoding policies.
+
+Samples detection windows (num_of_frame_in_sequence frames from one camera) from ORBIT output
+entries, asks each entry's PULS propositions under every policy, and compares the answers with
+the baseline policy (full resolution JPEG q95, what the clients always sent).
+
+    python scripts/benchmark_image_encoding.py --orbit-output /nas/.../ego_exo4d.json \
+        --api-base http://localhost:8000/v1 --num-entries 20 --max-side 448 336 224 --quality 95 80 60 --webp
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import argparse
+import random
+import json
+import time
+import sys
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from orbit.nsvs.video.sampler import get_video_frame_count, read_frames
+from orbit.nsvs.vlm.vllm_client import VLLMClient
+from orbit.nsvs.vlm.metrics import VLMMetrics
+from orbit.nsvs.vlm.encoding import ImageEncoder
+
+
+def sample_windows(entries, num_windows, frames_per_window, frame_step, rng):
+    """(frames, propositions) per window, frames from a random camera of a random entry"""
+    windows = []
+    for entry in entries:
+        propositions = entry.get("puls", {}).get("proposition") or []
+        if not propositions or not entry["video_paths"]:
+            continue
+        video_path = rng.choice(entry["video_paths"])
+        frame_count = get_video_frame_count(video_path)
+        span = frames_per_window * frame_step
+        if frame_count <= span:
+            continue
+        for _ in range(num_windows):
+            start = rng.randrange(0, frame_count - span)
+            indices = [start + i * frame_step for i in range(frames_per_window)]
+            frames = read_frames(video_path, indices)
+            if len(frames) == frames_per_window:
+                windows.append(([frames[i] for i in indices], propositions))
+    return windows
+
+def measure_policy(client, windows, threshold, num_workers):
+    # encode time and payload come from the requests detect actually built (per-frame or mosaic)
+    requests = [(frames, prop) for frames, propositions in windows for prop in propositions]
+    client.metrics = VLMMetrics()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        detections = list(executor.map(lambda r: client.detect(seq_of_frames=r[0], scene_description=r[1], threshold=threshold), requests))
+    elapsed = time.perf_counter() - start
+    histograms = client.metrics.to_dict()["histograms"]
+    frames_per_request = float(np.mean([len(frames) for frames, _ in requests]))
+
+    return {
+        "encode_ms_per_frame": 1000 * histograms["encode_s"]["mean"] / frames_per_request,
+        "payload_kb_per_request": histograms["payload_bytes"]["mean"] / 1024,
+        "requests_per_s": len(requests) / elapsed if elapsed else None,
+        "prompt_tokens_mean": histograms["prompt_tokens"]["mean"],
+        "server_latency_s_mean": histograms["server_latency_s"]["mean"],
+        "server_latency_s_p90": histograms["server_latency_s"]["p90"],
+        "detections": detections,
+    }
+
+def compare(baseline, detections, detection_threshold):
+    confidence_delta = [abs(a.confidence - b.confidence) for a, b in zip(baseline, detections)]
+    detected_flips = [a.is_detected != b.is_detected for a, b in zip(baseline, detections)]
+    threshold_flips = [
+        (a.get_detected_probability() > detection_threshold) != (b.get_detected_probability() > detection_threshold)
+        for a, b in zip(baseline, detections)
+    ]
+    return {
+        "mean_abs_confidence_delta": float(np.mean(confidence_delta)),
+        "is_detected_flip_rate": float(np.mean(detected_flips)),
+        "threshold_flip_rate": float(np.mean(threshold_flips)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orbit-output", default="/nas/mars/experiment_result/orbit/2_full_output/ego_exo4d.json")
+    parser.add_argument("--api-base", default="http://localhost:8000/v1")
+    parser.add_argument("--model", default="OpenGVLab/InternVL3_5-14B")
+    parser.add_argument("--num-entries", type=int, default=20)
+    parser.add_argument("--windows-per-entry", type=int, default=3)
+    parser.add_argument("--frames-per-window", type=int, default=3)
+    parser.add_argument("--frame-step", type=int, default=30)
+    parser.add_argument("--max-side", type=int, nargs="*", default=[0, 448, 336, 224], help="0 keeps full resolution")
+    parser.add_argument("--quality", type=int, nargs="*", default=[95, 80, 60])
+    parser.add_argument("--webp", action="store_true", help="also sweep WebP at the same qualities")
+    parser.add_argument("--dedupe", action="store_true", help="enable identical-frame dedupe in every policy")
+    parser.add_argument("--vlm-detection-threshold", type=float, default=0.349)
+    parser.add_argument("--detection-threshold", type=float, default=0.5)
+    parser.add_argument("--num-workers", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="image_encoding_benchmark.json")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with open(args.orbit_output, "r") as f:
+        entries = json.load(f)
+    entries = rng.sample(entries, min(args.num_entries, len(entries)))
+    windows = sample_windows(entries, args.windows_per_entry, args.frames_per_window, args.frame_step, rng)
+    print(f"{len(windows)} windows, {sum(len(p) for _, p in windows)} requests per policy")
+
+    formats = ["jpeg", "webp"] if args.webp else ["jpeg"]
+    policies = [ImageEncoder(max_side=None, quality=95, image_format="jpeg", dedupe=False)]
+    for image_format in formats:
+        for max_side in args.max_side:
+            for quality in args.quality:
+                policy = ImageEncoder(max_side=max_side or None, quality=quality, image_format=image_format, dedupe=args.dedupe)
+                if repr(policy) != repr(policies[0]):
+                    policies.append(policy)
+
+    results = []
+    baseline = None
+    for policy in policies:
+        client = VLLMClient(api_base=args.api_base, model=args.model, encoder=policy)
+        measured = measure_policy(client, windows, args.vlm_detection_threshold, args.num_workers)
+        detections = measured.pop("detections")
+        if baseline is None:
+            baseline = detections
+        measured.update(compare(baseline, detections, args.detection_threshold))
+        measured["policy"] = repr(policy)
+        results.append(measured)
+        print(
+            f"{repr(policy):70s} {measured['payload_kb_per_request']:8.1f} KB  {measured['encode_ms_per_frame']:6.2f} ms/frame  "
+            f"{measured['requests_per_s'] or 0:6.1f} req/s  dconf={measured['mean_abs_confidence_delta']:.3f}  "
+            f"flips={measured['threshold_flip_rate']:.2%}"
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"Saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
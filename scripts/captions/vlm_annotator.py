@@ -22,6 +22,7 @@ from dataclasses import asdict
 
 # Add parent directory to path to import dataloader
 sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent.parent)) # repo root, for orbit
 
 try:
     from openai import OpenAI
@@ -30,6 +31,7 @@ except ImportError:
 
 from nuscenes_dataloader import NuScenesLidarSegmentationLoader, FrameData, ObjectProperties
 from scenegraph import SceneGraphBuilder, SceneGraphNode
+from orbit.nsvs.vlm.encoding import ImageEncoder
 
 
 class VLMAnnotator:
@@ -53,15 +55,13 @@ class VLMAnnotator:
         """
         self.client = OpenAI(api_key="EMPTY", base_url=api_base)
         self.model = model
+        self.encoder = ImageEncoder.from_env()
         self.dataloader = dataloader
         self.nusc = dataloader.nusc
     
     def _encode_image(self, image: np.ndarray) -> str:
-        """Encode a cv2 image to base64 string."""
-        ret, buffer = cv2.imencode(".jpg", image)
-        if not ret:
-            raise ValueError("Could not encode image")
-        return base64.b64encode(buffer).decode("utf-8")
+        """Encode a cv2 image to a data URL per the shared encoding policy."""
+        return self.encoder.data_url(image)
     
     def _load_camera_image(self, camera_token: str) -> Optional[np.ndarray]:
         """Load camera image from token."""
@@ -157,7 +157,7 @@ Examples: "driving straight", "turning left", "stopped at intersection", "walkin
             {"type": "text", "text": prompt},
             {
                 "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"},
+                "image_url": {"url": encoded_image},
             }
         ]
         
@@ -209,7 +209,7 @@ Describe this {class_name} in detail (2-3 sentences). Include:
             {"type": "text", "text": prompt},
             {
                 "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"},
+                "image_url": {"url": encoded_image},
             }
         ]
         
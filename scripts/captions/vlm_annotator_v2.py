@@ -25,6 +25,7 @@ from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
 # Add parent directory to path to import dataloader
 sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent.parent.parent)) # repo root, for orbit
 
 try:
     from openai import OpenAI
@@ -37,6 +38,7 @@ from pyquaternion import Quaternion
 
 from scenegraph.nuscenes_dataloader import NuScenesLidarSegmentationLoader, FrameData, ObjectProperties
 from scenegraph.scenegraph import SceneGraphBuilder, SceneGraphNode
+from orbit.nsvs.vlm.encoding import ImageEncoder
 
 
 class InstanceAnnotator:
@@ -64,6 +66,7 @@ class InstanceAnnotator:
         """
         self.client = OpenAI(api_key="EMPTY", base_url=api_base)
         self.model = model
+        self.encoder = ImageEncoder.from_env()
         self.dataloader = dataloader
         self.nusc = dataloader.nusc
         self.max_workers = max_workers
@@ -71,11 +74,8 @@ class InstanceAnnotator:
         self.executor = ThreadPoolExecutor(max_workers=max_workers)
     
     def _encode_image(self, image: np.ndarray) -> str:
-        """Encode a cv2 image to base64 string."""
-        ret, buffer = cv2.imencode(".jpg", image)
-        if not ret:
-            raise ValueError("Could not encode image")
-        return base64.b64encode(buffer).decode("utf-8")
+        """Encode a cv2 image to a data URL per the shared encoding policy."""
+        return self.encoder.data_url(image)
     
     def _load_camera_image(self, camera_token: str) -> Optional[np.ndarray]:
         """Load camera image from token."""
@@ -351,7 +351,7 @@ class InstanceAnnotator:
             Tuple of (activity, description)
         """
         # Encode all images
-        encoded_images = [self._encode_image(img) for img in images]
+        encoded_images = self.encoder.data_urls(images)
         
         # Build prompt
         class_name = object_class.split('.')[-1].replace('_', ' ')
@@ -396,7 +396,7 @@ DESCRIPTION: [detailed description]"""
         for encoded_img in encoded_images:
             content.append({
                 "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{encoded_img}"}
+                "image_url": {"url": encoded_img}
             })
         
         try:
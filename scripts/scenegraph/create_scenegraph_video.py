@@ -7,6 +7,7 @@ all detected objects with their bounding boxes and labels on camera images.
 
 import argparse
 import json
+import sys
 import os
 from typing import Dict, List, Tuple, Optional, Union
 from pathlib import Path
@@ -20,6 +21,9 @@ from pyquaternion import Quaternion
 from shapely.geometry import MultiPoint, box
 import traceback
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from orbit.utils import profiling
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description="Create MP4 video from scene graph JSON with objects overlaid on camera images."
@@ -94,6 +98,7 @@ def parse_args() -> argparse.Namespace:
         default=2,
         help="Line thickness"
     )
+    profiling.add_arguments(parser) # stage: video (one per camera, indexed in --cameras order)
     
     return parser.parse_args()
 
@@ -462,6 +467,7 @@ def load_captions(captions_json: str) -> Dict:
 
 def main():
     args = parse_args()
+    profiling.configure_from_args(args)
     
     print("="*60)
     print("Scene Graph Video Creator")
@@ -492,19 +498,20 @@ def main():
     scene_name = scene_graph.get('scene_name', scene_graph.get('scene_token', 'scene'))
     
     # Create video for each camera
-    for camera in args.cameras:
+    for camera_idx, camera in enumerate(args.cameras):
         output_path = output_dir / "videos" / f"{scene_name}_{camera}.mp4"
         
         try:
-            create_video_for_camera(
-                nusc=nusc,
-                scene_graph=scene_graph,
-                camera=camera,
-                output_path=str(output_path),
-                args=args,
-                annotations=annotations,
-                captions=captions
-            )
+            with profiling.stage("video", entry=f"{scene_name}_{camera}", index=camera_idx):
+                create_video_for_camera(
+                    nusc=nusc,
+                    scene_graph=scene_graph,
+                    camera=camera,
+                    output_path=str(output_path),
+                    args=args,
+                    annotations=annotations,
+                    captions=captions
+                )
         except Exception as e:
             print(f"\nError creating video for {camera}: {e}")
             import traceback
@@ -6,6 +6,7 @@ lidar segmentation maps along with object properties per frame.
 """
 
 import os
+import sys
 import json
 import numpy as np
 from typing import Dict, List, Optional, Tuple, Any
@@ -13,6 +14,9 @@ from dataclasses import dataclass, asdict
 from pathlib import Path
 import pickle
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from orbit.utils import profiling
+
 try:
     from nuscenes.nuscenes import NuScenes
     from nuscenes.utils.data_classes import LidarPointCloud
@@ -376,9 +380,11 @@ class NuScenesLidarSegmentationLoader:
         if self.verbose:
             print(f"Loading {len(sample_tokens)} frames from scene {scene_token}")
         
-        for sample_token in sample_tokens:
+        for frame_idx, sample_token in enumerate(sample_tokens):
             try:
-                frame_data = self.get_frame_data(sample_token)
+                # ORBIT_PROFILE=frame samples this, mostly _get_lidar_segmentation
+                with profiling.stage("frame", entry=sample_token, index=frame_idx):
+                    frame_data = self.get_frame_data(sample_token)
                 frames.append(frame_data)
             except Exception as e:
                 print(f"Error loading frame {sample_token}: {e}")
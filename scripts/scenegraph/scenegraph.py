@@ -6,6 +6,7 @@ and properties that we want to annotate for these objects with a VLM (activity,
 """
 
 import os
+import sys
 import json
 from pathlib import Path
 from typing import Dict, List, Optional, Any
@@ -13,6 +14,9 @@ from dataclasses import dataclass, asdict
 import numpy as np
 from tqdm import tqdm
 from argparse import ArgumentParser
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from orbit.utils import profiling
 from nuscenes_dataloader import (
     NuScenesLidarSegmentationLoader,
     FrameData,
@@ -323,11 +327,13 @@ def parse_args():
     parser.add_argument('--version', type=str, required=False, help='Version of nuScenes dataset', default='v1.0-trainval')
     parser.add_argument('--output-dir', type=str, required=False, help='Path to output directory', default='outputs/scene_graphs')
     parser.add_argument('--num-scenes', type=int, required=False, help='Number of scenes to process', default=1)
+    profiling.add_arguments(parser) # stages: scene, frame (per sample, with index within the scene)
     return parser.parse_args()
 
 def main():
     """Example usage of the SceneGraphBuilder."""
     args = parse_args()
+    profiling.configure_from_args(args)
     # Configuration
     dataroot = args.dataroot
     version = args.version
@@ -355,7 +361,8 @@ def main():
             print(f"Building scene graphs for scene: {scene_token} {i+1}/{args.num_scenes}")
             
             # Build scene graphs
-            all_nodes, all_relationships = builder.build_scene_graphs(scene_token)
+            with profiling.stage("scene", entry=scene_token, index=i):
+                all_nodes, all_relationships = builder.build_scene_graphs(scene_token)
             
             print(f"\nProcessed {len(all_nodes)} frames")
             
@@ -0,0 +1,134 @@
+"""Per-entry time breakdown of an ORBIT trace (ORBIT_TRACE / run_orbit(trace_path=...)).
+
+For every entry, reports its wall time (first to last span of the entry or its take's decode) and
+how much of it each category kept busy: decode, LLM (PULS + target identification), VLM, frame
+validation, stormpy model checking, cropping and VQA. Busy time is the union of a category's
+spans, so concurrent VLM requests are not double counted. Worker-process files
+(<name>.<pid><ext>) are picked up with the main one.
+
+    python scripts/trace_summary.py /nas/.../ego_exo4d_trace.jsonl --top 20
+"""
+from collections import defaultdict
+from pathlib import Path
+import argparse
+import json
+import glob
+import os
+
+
+CATEGORIES = {
+    "read_video": "decode",
+    "PULS": "llm",
+    "identify_target": "llm",
+    "detect": "vlm",
+    "detect_cameras": "vlm",
+    "validate_frame": "validate",
+    "check_automaton": "stormpy",
+    "crop_video": "crop",
+    "load_frames": "vqa",
+    "vqa": "vqa",
+}
+
+
+def load_spans(path: str) -> list[dict]:
+    """Spans as {"name", "start", "end", "entry", "take"} from the JSONL or Chrome trace at path (and its worker files)"""
+    stem, ext = os.path.splitext(path)
+    spans = []
+    for file_path in [path] + sorted(glob.glob(f"{glob.escape(stem)}.*{ext}")):
+        with open(file_path, "r") as f:
+            if ext == ".json":
+                text = f.read().rstrip().rstrip(",")
+                events = json.loads(text if text.endswith("]") else text + "]") # killed runs leave the array open
+                records = [
+                    {"name": e["name"], "start": e["ts"] / 1e6, "duration": e["dur"] / 1e6, **e.get("args", {})}
+                    for e in events if e.get("ph") == "X"
+                ]
+            else:
+                records = []
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue # torn last line
+        for record in records:
+            spans.append({
+                "name": record["name"],
+                "start": record["start"],
+                "end": record["start"] + record["duration"],
+                "entry": record.get("entry"),
+                "take": record.get("take"),
+            })
+    return spans
+
+def union_length(intervals: list[tuple[float, float]]) -> float:
+    total, current_start, current_end = 0.0, None, None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+def breakdown(spans: list[dict]) -> dict[str, dict]:
+    """entry -> {"wall": seconds, <category>: busy seconds}"""
+    take_entries = defaultdict(set)
+    for span in spans:
+        if span["entry"] is not None and span["take"] is not None:
+            take_entries[span["take"]].add(span["entry"])
+
+    per_entry = defaultdict(list)
+    for span in spans:
+        if span["entry"] is not None:
+            per_entry[span["entry"]].append(span)
+        elif span["take"] is not None: # a take's decode is on the critical path of each of its entries
+            for entry in take_entries[span["take"]]:
+                per_entry[entry].append(span)
+
+    results = {}
+    for entry, entry_spans in per_entry.items():
+        row = {"wall": max(s["end"] for s in entry_spans) - min(s["start"] for s in entry_spans)}
+        by_category = defaultdict(list)
+        for span in entry_spans:
+            if span["name"] in CATEGORIES:
+                by_category[CATEGORIES[span["name"]]].append((span["start"], span["end"]))
+        for category in dict.fromkeys(CATEGORIES.values()):
+            row[category] = union_length(by_category[category])
+        results[entry] = row
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace")
+    parser.add_argument("--top", type=int, default=10, help="slowest entries to list")
+    parser.add_argument("--output", default=None, help="write the per-entry breakdown as JSON")
+    args = parser.parse_args()
+
+    results = breakdown(load_spans(args.trace))
+    if not results:
+        print("No entry spans in trace")
+        return
+    categories = list(dict.fromkeys(CATEGORIES.values()))
+
+    total_wall = sum(row["wall"] for row in results.values())
+    print(f"{len(results)} entries, mean wall {total_wall / len(results):.2f}s")
+    for category in categories:
+        busy = sum(row[category] for row in results.values())
+        if busy:
+            print(f"  {category:<9} {busy / len(results):8.2f}s/entry  {busy / total_wall:6.1%} of wall")
+
+    print(f"\nSlowest {args.top} entries:")
+    print(f"{'entry':<40} {'wall':>8} " + " ".join(f"{c:>9}" for c in categories))
+    for entry, row in sorted(results.items(), key=lambda item: -item[1]["wall"])[:args.top]:
+        print(f"{str(entry)[:40]:<40} {row['wall']:8.2f} " + " ".join(f"{row[c]:9.2f}" for c in categories))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"\nSaved per-entry breakdown to {Path(args.output).resolve()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Deterministic stand-in for a vLLM OpenAI-compatible server, for CPU-only throughput benchmarks.
+
+Speaks enough of the chat-completions API for VLLMClient.detect (Yes/No with logprobs and
+top_logprobs), VLLMClient.detect_cameras (a camera letter or None), the VQA multiple-choice client
+(one letter) and the caption scripts (free text). Answers are derived from --seed and the request
+content, or replayed from a --trace JSONL file (as written by --dump-trace). A trace line is looked
+up by its exact request "fingerprint", then by ("proposition", "images"), the fingerprint of the
+request's images, i.e. one window; lines with only a "proposition" are picked by the images'
+fingerprint. Lookups never depend on request arrival order, so concurrent clients replay the same.
+
+Usage:
+    python scripts/vllm/fake_vllm_server.py --port 8000 --latency lognormal:-1.2,0.4 --max-concurrency 16
+    run_nsvs(..., device=0)  # talks to http://localhost:8000/v1
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import defaultdict
+import threading
+import argparse
+import hashlib
+import random
+import json
+import math
+import time
+import re
+
+
+# low-probability alternatives; none may strip to an answer token (Yes/No, a camera letter, None)
+FILLER_TOKENS = ["The", "I", "It", "There", "Not", "Maybe", "Sure", "Nope", "Yeah", "Nah", "Is", "This", "In", "J", "K", "Z"]
+PROPOSITION_PATTERN = re.compile(r"Is there a '(.*?)' present")
+CAMERA_PROPOSITION_PATTERN = re.compile(r"Which camera shows a '(.*?)'\?")
+CAMERA_LETTERS_PATTERN = re.compile(r"single camera letter \(([A-Z](?:, [A-Z])*)\) or None")
+
+
+class LatencyModel:
+    """Parses 'fixed:s', 'uniform:a,b' or 'lognormal:mu,sigma' (seconds) plus a per-image cost."""
+    def __init__(self, spec: str, per_image: float = 0.0):
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",")] if params else []
+        self.per_image = per_image
+
+    def sample(self, rng: random.Random, num_images: int) -> float:
+        if self.kind == "fixed":
+            base = self.params[0] if self.params else 0.0
+        elif self.kind == "uniform":
+            base = rng.uniform(*self.params)
+        elif self.kind == "lognormal":
+            base = rng.lognormvariate(*self.params)
+        else:
+            raise ValueError(f"Unknown latency model: {self.kind}")
+        return base + self.per_image * num_images
+
+
+class FakeBackend:
+    def __init__(self, seed: int, latency: LatencyModel, max_concurrency: int, trace_path: str | None, dump_path: str | None, tokens_per_image: int):
+        self.seed = seed
+        self.latency = latency
+        self.tokens_per_image = tokens_per_image
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.by_fingerprint = {}
+        self.by_window = {}
+        self.by_proposition = defaultdict(list)
+        self.lock = threading.Lock()
+        self.dump_file = open(dump_path, "a") if dump_path else None
+        self.num_requests = 0
+        if trace_path:
+            with open(trace_path, "r") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if "fingerprint" in record:
+                        self.by_fingerprint[record["fingerprint"]] = record["yes_prob"]
+                    if "proposition" in record and "images" in record:
+                        self.by_window[(record["proposition"], record["images"])] = record["yes_prob"]
+                    elif "proposition" in record:
+                        self.by_proposition[record["proposition"]].append(record["yes_prob"])
+
+    def _texts_and_images(self, messages: list[dict]) -> tuple[list[str], list[str]]:
+        texts, images = [], []
+        for message in messages:
+            content = message.get("content")
+            if isinstance(content, str):
+                texts.append(content)
+                continue
+            for part in content or []:
+                if part.get("type") == "image_url":
+                    images.append(part["image_url"]["url"])
+                elif part.get("type") == "text":
+                    texts.append(part["text"])
+        return texts, images
+
+    def _yes_prob(self, fingerprint: str, images_fingerprint: str, proposition: str | None, rng: random.Random) -> float:
+        if fingerprint in self.by_fingerprint:
+            return self.by_fingerprint[fingerprint]
+        if (proposition, images_fingerprint) in self.by_window:
+            return self.by_window[(proposition, images_fingerprint)]
+        if proposition in self.by_proposition:
+            values = self.by_proposition[proposition]
+            return values[int(images_fingerprint, 16) % len(values)]
+        # mostly-confident answers with a band of ambiguous ones, like a real VLM
+        return rng.betavariate(0.4, 0.6)
+
+    def _top_logprobs(self, answers: list[tuple[str, float]], rng: random.Random, top_k: int) -> list[dict]:
+        """answers: (token, probability) pairs summing to 1; filler tokens share a small remainder"""
+        rest = 0.02 * rng.random()
+        entries = [(token, max(p * (1 - rest), 1e-9)) for token, p in answers]
+        for token in FILLER_TOKENS[:max(0, top_k - len(answers))]:
+            entries.append((token, max(rest * rng.random() / len(FILLER_TOKENS), 1e-12)))
+        entries.sort(key=lambda e: e[1], reverse=True)
+        return [{"token": token, "logprob": math.log(p), "bytes": list(token.encode())} for token, p in entries[:top_k]]
+
+    def _camera_answers(self, yes_prob: float, letters: list[str], rng: random.Random) -> list[tuple[str, float]]:
+        """P(any camera) = yes_prob, split over the cameras with one clear favourite"""
+        weights = [rng.random() ** 3 for _ in letters]
+        weights[rng.randrange(len(letters))] += 1.0
+        total = sum(weights)
+        return [(letter, yes_prob * w / total) for letter, w in zip(letters, weights)] + [("None", 1 - yes_prob)]
+
+    def complete(self, body: dict) -> dict:
+        messages = body.get("messages", [])
+        texts, images = self._texts_and_images(messages)
+        fingerprint = hashlib.sha256(json.dumps([texts, images]).encode("utf-8")).hexdigest()
+        images_fingerprint = hashlib.sha256(json.dumps(images).encode("utf-8")).hexdigest()
+        rng = random.Random(f"{self.seed}:{fingerprint}")
+
+        with self.slots:
+            time.sleep(self.latency.sample(rng, len(images)))
+
+        proposition, letters = None, None
+        for text in texts:
+            match = PROPOSITION_PATTERN.search(text) or CAMERA_PROPOSITION_PATTERN.search(text)
+            if match:
+                proposition = match.group(1)
+            match = CAMERA_LETTERS_PATTERN.search(text)
+            if match:
+                letters = match.group(1).split(", ")
+
+        logprobs = None
+        if body.get("logprobs"):
+            yes_prob = self._yes_prob(fingerprint, images_fingerprint, proposition, rng)
+            answers = self._camera_answers(yes_prob, letters, rng) if letters else [("Yes", yes_prob), ("No", 1 - yes_prob)]
+            top_logprobs = self._top_logprobs(answers, rng, int(body.get("top_logprobs") or len(answers)))
+            content = top_logprobs[0]["token"]
+            logprobs = {"content": [{**top_logprobs[0], "top_logprobs": top_logprobs}]}
+            if self.dump_file:
+                record = {"fingerprint": fingerprint, "images": images_fingerprint, "proposition": proposition, "yes_prob": yes_prob}
+                with self.lock:
+                    self.dump_file.write(json.dumps(record) + "\n")
+                    self.dump_file.flush()
+        elif body.get("max_tokens") == 1:
+            content = rng.choice("abcd")
+        else:
+            content = f"A deterministic placeholder caption ({fingerprint[:8]})."
+
+        prompt_tokens = sum(len(text) // 4 for text in texts) + self.tokens_per_image * len(images)
+        with self.lock:
+            self.num_requests += 1
+        return {
+            "id": f"chatcmpl-{fingerprint[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "logprobs": logprobs,
+                "finish_reason": "length",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": 1,
+                "total_tokens": prompt_tokens + 1,
+            },
+        }
+
+
+def make_handler(backend: FakeBackend, model: str):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # keep-alive, like vLLM
+
+        def _send(self, status: int, payload: dict) -> None:
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path in ("/health", "/v1/health"):
+                self._send(200, {})
+            elif self.path == "/v1/models":
+                self._send(200, {"object": "list", "data": [{"id": model, "object": "model", "owned_by": "fake"}]})
+            else:
+                self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+        def do_POST(self):
+            if self.path != "/v1/chat/completions":
+                self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            self._send(200, backend.complete(body))
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--model", default="OpenGVLab/InternVL3_5-14B")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", default="fixed:0.0", help="fixed:s | uniform:a,b | lognormal:mu,sigma (seconds)")
+    parser.add_argument("--per-image-latency", type=float, default=0.0, help="extra seconds per image in the request")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="requests served at once; the rest queue")
+    parser.add_argument("--tokens-per-image", type=int, default=256, help="prompt tokens reported per image")
+    parser.add_argument("--trace", default=None, help="JSONL of yes_prob by fingerprint or proposition to replay")
+    parser.add_argument("--dump-trace", default=None, help="append served Yes/No answers as a replayable trace")
+    args = parser.parse_args()
+
+    backend = FakeBackend(
+        seed=args.seed,
+        latency=LatencyModel(args.latency, per_image=args.per_image_latency),
+        max_concurrency=args.max_concurrency,
+        trace_path=args.trace,
+        dump_path=args.dump_trace,
+        tokens_per_image=args.tokens_per_image,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(backend, args.model))
+    server.daemon_threads = True
+    print(f"Fake vLLM server on http://{args.host}:{args.port}/v1 (model={args.model}, seed={args.seed})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Served {backend.num_requests} requests")
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
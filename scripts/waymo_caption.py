@@ -5,30 +5,33 @@ import base64
 from tqdm import tqdm
 import tensorflow as tf
 from openai import OpenAI
+from pathlib import Path
+import sys
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from orbit.nsvs.vlm.encoding import ImageEncoder
 
 
 class VLLMCaptioner:
     """A client to generate captions using a vLLM server."""
-    def __init__(self, api_base, model):
+    def __init__(self, api_base, model, encoder=None):
         self.client = OpenAI(api_key="EMPTY", base_url=api_base)
         self.model = model
+        self.encoder = encoder if encoder is not None else ImageEncoder.from_env()
 
     def _encode_image(self, frame):
-        """Encodes a cv2 frame to a base64 string."""
-        ret, buffer = cv2.imencode(".jpg", frame)
-        if not ret:
-            raise ValueError("Could not encode frame")
-        return base64.b64encode(buffer).decode("utf-8")
+        """Encodes a cv2 frame to a data URL per the shared encoding policy."""
+        return self.encoder.data_url(frame)
 
     def get_caption(self, image, prompt):
         """Generates a caption for a single image using the vLLM server."""
-        encoded_image = self._encode_image(image)
+        image_url = self._encode_image(image)
 
         user_content = [
             {"type": "text", "text": prompt},
             {
                 "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{encoded_image}"},
+                "image_url": {"url": image_url},
             }
         ]
 
@@ -0,0 +1,48 @@
+import pytest
+
+from orbit.nsvs.vlm.prefilter import match_objects, noun_map
+
+
+COCO_NAMES = [
+    "person", "bicycle", "car", "motorcycle", "bus", "train", "truck", "bench", "bear", "tie",
+    "wine glass", "cup", "knife", "bowl", "orange", "dining table", "couch", "tv", "mouse",
+    "remote", "keyboard", "cell phone", "sink", "refrigerator", "book", "teddy bear",
+]
+
+
+@pytest.fixture(scope="module")
+def nouns():
+    return noun_map(COCO_NAMES)
+
+
+@pytest.mark.parametrize("proposition, expected", [
+    ("person_holds_knife", ["person", "knife"]),
+    ("wine glass on the dining table", ["wine glass", "dining table"]),
+    ("man_uses_cell_phones", ["person", "cell phone"]),
+    ("women riding bikes", ["person", "bicycle"]),
+    ("teddy_bear_on_couch", ["teddy bear", "couch"]),
+])
+def test_unambiguous_nouns_map_to_classes(nouns, proposition, expected):
+    assert match_objects(proposition, nouns) == expected
+
+
+@pytest.mark.parametrize("proposition, expected", [
+    ("person_ties_shoelaces", ["person"]), # verb, not the "tie" class
+    ("glass_of_water", []), # a drinking glass is not necessarily a wine glass
+    ("table_is_set", []), # nor is any table a dining table
+    ("orange_car", ["car"]), # colour, not the fruit
+    ("bear_in_forest", []), # stoplisted on its own, still matched as "teddy bear"
+    ("person_uses_mouse", ["person"]),
+])
+def test_ambiguous_words_are_not_matched(nouns, proposition, expected):
+    assert match_objects(proposition, nouns) == expected
+
+
+@pytest.mark.parametrize("proposition", ["no_person_in_kitchen", "room is empty of people", "car without driver"])
+def test_negated_propositions_are_never_ruled_out(nouns, proposition):
+    assert match_objects(proposition, nouns) is None
+
+
+def test_only_classes_the_model_has():
+    assert match_objects("chef uses phone", noun_map(["person"])) == []
+    assert "cell phone" not in noun_map(["person"]).values()
@@ -6,11 +6,24 @@ import cv2
 import json
 import os
 import tqdm
-from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
+import argparse
+
+from orbit.nsvs.vlm.encoding import ImageEncoder
+from orbit.nsvs.video.sampler import get_video_frame_count, uniform_indices, read_frames
+from orbit.datamanager.manager import stitch_grid
+from orbit.utils import profiling, tracing
 
 
 NUM_SAMPLES = 48
 NUM_WORKERS = 4
+NUM_DECODE_WORKERS = 4
+QUEUE_DEPTH = 16
+VIDEO_MODE = "cropped" # "cropped": read 3_cropped_videos, "virtual": read frames_of_interest from the source videos
+CROPPED_VIDEO_DIR = "/nas/mars/experiment_result/orbit/3_cropped_videos/Ego-Exo4D"
+ORBIT_OUTPUT_PATH = "/nas/mars/experiment_result/orbit/2_full_output/ego_exo4d.json"
+RESULTS_DIR = "/nas/mars/experiment_result/orbit/4_vqa_results"
 
 class VLLMClient:
     def __init__(
@@ -18,15 +31,14 @@ class VLLMClient:
         api_key="EMPTY",
         api_base="http://localhost:8002/v1",
         model="OpenGVLab/InternVL3_5-14B",
+        encoder=None,
     ):
         self.client = OpenAI(api_key=api_key, base_url=api_base)
         self.model = model
+        self.encoder = encoder if encoder is not None else ImageEncoder.from_env()
 
     def _encode_frame(self, frame):
-        ret, buffer = cv2.imencode(".jpg", frame)
-        if not ret:
-            raise ValueError("Could not encode frame")
-        return base64.b64encode(buffer).decode("utf-8")
+        return self.encoder.encode(frame)
 
     def multiple_choice(self, frames_by_cam: dict, question: str, candidates: list[str]) -> str:
         user_content = []
@@ -38,12 +50,11 @@ class VLLMClient:
                 }
             )
             frames = list(frames_by_cam.values())[0]
-            encoded_images = [self._encode_frame(frame) for frame in frames]
-            for encoded in encoded_images:
+            for image_url in self.encoder.data_urls(frames):
                 user_content.append(
                     {
                         "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{encoded}"},
+                        "image_url": {"url": image_url},
                     }
                 )
         else:
@@ -55,12 +66,11 @@ class VLLMClient:
             )
             for cam_name, frames in frames_by_cam.items():
                 user_content.append({"type": "text", "text": f"Camera {cam_name}:"})
-                encoded_images = [self._encode_frame(frame) for frame in frames]
-                for encoded in encoded_images:
+                for image_url in self.encoder.data_urls(frames):
                     user_content.append(
                         {
                             "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{encoded}"},
+                            "image_url": {"url": image_url},
                         }
                     )
 
@@ -87,91 +97,185 @@ class VLLMClientMultiprocessing(VLLMClient):
         max_workers=NUM_WORKERS,
     ):
         super().__init__()
-        self.executor = ThreadPoolExecutor(max_workers=max_workers)
-
-    def multiple_choice_batch(self, batch_args):
-        futures = [
-            self.executor.submit(self.multiple_choice, *args) for args in batch_args
-        ]
-        
-        results = []
-        for future in tqdm.tqdm(futures, desc="Processing batch"):
-            try:
-                result = future.result()
-                results.append(result)
-            except Exception as e:
-                print(f"Error processing a task: {e}")
-                results.append(None)
-                
-        return results
-
-def get_video_frame_count(video_path):
-    cap = cv2.VideoCapture(video_path)
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
-    cap.release()
-    return frame_count
+        self.max_workers = max_workers # request threads run_experiment starts against this client
 
 def load_video_frames(video_path, num_frames):
-    frame_count = get_video_frame_count(video_path)
-    if frame_count < num_frames:
-        frame_indices = np.arange(frame_count)
+    frame_indices = uniform_indices(get_video_frame_count(video_path), num_frames)
+    frames = read_frames(video_path, frame_indices)
+    return [frames[idx] for idx in frame_indices if idx in frames]
+
+def load_foi_frames(orbit_entry, num_frames):
+    """Sample frames of a virtual crop: same frames and stitching as crop_video, without writing the crop"""
+    foi = orbit_entry.get("frames_of_interest", {})
+    video_paths = {os.path.basename(path).split('.')[0]: path for path in orbit_entry["video_paths"]}
+
+    sorted_frame_nums = []
+    for frame_num in sorted(int(f) for f in foi.keys()):
+        if any(cam in video_paths for cam in foi[str(frame_num)]):
+            sorted_frame_nums.append(frame_num)
+    if not sorted_frame_nums:
+        return []
+
+    if len(sorted_frame_nums) < num_frames:
+        positions = np.arange(len(sorted_frame_nums))
     else:
-        frame_indices = np.linspace(0, frame_count - 1, num_frames, dtype=int)
+        positions = np.linspace(0, len(sorted_frame_nums) - 1, num_frames, dtype=int)
+    target_frames = [sorted_frame_nums[p] for p in positions]
 
-    images = []
-    cap = cv2.VideoCapture(video_path)
-    for idx in frame_indices:
-        cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
-        ok, frame_bgr = cap.read()
-        if ok and frame_bgr is not None:
-            frame_rgb = cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
-            images.append(frame_rgb)
+    # collect every (camera, frame) we need so each camera is decoded in one pass
+    needed = {}
+    for frame_num in target_frames:
+        for cam_name in foi[str(frame_num)]:
+            if cam_name in video_paths:
+                needed.setdefault(cam_name, set()).add(frame_num)
+
+    decoded = {}
+    for cam_name in sorted(needed):
+        for frame_num, frame in read_frames(video_paths[cam_name], needed[cam_name]).items():
+            decoded[(cam_name, frame_num)] = frame
+    cap = cv2.VideoCapture(orbit_entry["video_paths"][0]) # crop_video sizes the grid after the first camera
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     cap.release()
+
+    images = []
+    for frame_num in target_frames:
+        frames_to_stitch = []
+        labels = []
+        for cam_name in sorted(foi[str(frame_num)]):
+            if (cam_name, frame_num) in decoded:
+                frames_to_stitch.append(decoded[(cam_name, frame_num)])
+                labels.append(cam_name)
+        if not frames_to_stitch:
+            continue
+        images.append(stitch_grid(frames_to_stitch, labels, width, height))
     return images
 
-def run_experiment(dataset, vllm_client):
+def load_orbit_output(orbit_output_path):
+    with open(orbit_output_path, "r") as f:
+        data = json.load(f)
+    return {entry["video_id"]: entry for entry in data}
+
+def load_entry_frames(key, video_mode, orbit_output):
+    if video_mode == "virtual":
+        if key not in orbit_output:
+            return None
+        return load_foi_frames(orbit_output[key], num_frames=NUM_SAMPLES)
+
+    video_path = os.path.join(CROPPED_VIDEO_DIR, f"{key}.mp4")
+    if not os.path.exists(video_path):
+        return None
+    return load_video_frames(video_path, num_frames=NUM_SAMPLES)
+
+def run_experiment(dataset, vllm_client, video_mode=VIDEO_MODE):
+    # decode workers -> bounded frame_queue -> request workers -> JSONL, so only QUEUE_DEPTH entries of frames are ever held
+    orbit_output = load_orbit_output(ORBIT_OUTPUT_PATH) if video_mode == "virtual" else {}
+
+    positions = {key: i for i, key in enumerate(dataset)} # entry indices for --profile-entries
+    key_queue = queue.Queue()
+    for key in dataset:
+        key_queue.put(key)
+    frame_queue = queue.Queue(maxsize=QUEUE_DEPTH)
+
     results = {}
-    all_entries = {}
-    batch_args_all_calls = []
+    lock = threading.Lock()
+    pbar = tqdm.tqdm(total=len(dataset), desc="Processing")
 
-    for key in tqdm.tqdm(list(dataset.keys()), desc=f"Preparing"):
-        entry = dataset[key]
-        video_path = os.path.join("/nas/mars/experiment_result/orbit/3_cropped_videos/Ego-Exo4D", f"{key}.mp4")
-        if not os.path.exists(video_path):
-            continue
-        
-        frames = load_video_frames(video_path, num_frames=NUM_SAMPLES)
-        if not frames:
-            # print(f"Could not load frames from {video_path}")
-            continue
-        
-        question = entry["question"]
-        candidates = entry["candidates"]
-        batch_args_all_calls.append(({"main": frames}, question, candidates))
-        all_entries[key] = entry
-
-    predicted_answers_all_calls = vllm_client.multiple_choice_batch(batch_args_all_calls)
-    total_correct = 0
-    for i, key in enumerate(all_entries):
-        entry = all_entries[key]
-        predicted_answer = predicted_answers_all_calls[i]
-        correct_answer = entry["correct_answer"]
-        is_correct = 1 if predicted_answer == correct_answer else 0
-        total_correct += is_correct
-        results[key] = {
-            "question": entry["question"],
-            "predicted_answer": predicted_answer,
-            "correct_answer": correct_answer,
-            "is_correct": is_correct
-        }
-
-    with open(f"/nas/mars/experiment_result/orbit/4_vqa_results/ego_exo4d_results.json", "w") as f:
+    def decode_worker():
+        while True:
+            try:
+                key = key_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                with (
+                    tracing.context(entry=key),
+                    tracing.span("load_frames", mode=video_mode),
+                    profiling.stage("load_frames", entry=key, index=positions[key]),
+                ):
+                    frames = load_entry_frames(key, video_mode, orbit_output)
+            except Exception as e:
+                print(f"Error loading frames for {key}: {e}")
+                frames = None
+            if frames:
+                frame_queue.put((key, frames)) # blocks while the request workers are behind
+            else:
+                with lock:
+                    pbar.update(1)
+
+    def request_worker(out_file):
+        # any error is recorded in the entry's row; a dead worker would leave the decoders blocked on frame_queue
+        while True:
+            item = frame_queue.get()
+            if item is None:
+                frame_queue.task_done()
+                return
+            key, frames = item
+            del item
+            try:
+                entry = dataset[key]
+                with tracing.context(entry=key), tracing.span("vqa"), profiling.stage("vqa", entry=key, index=positions[key]):
+                    predicted_answer = vllm_client.multiple_choice({"main": frames}, entry["question"], entry["candidates"])
+                correct_answer = entry["correct_answer"]
+                result = {
+                    "question": entry["question"],
+                    "predicted_answer": predicted_answer,
+                    "correct_answer": correct_answer,
+                    "is_correct": 1 if predicted_answer == correct_answer else 0
+                }
+            except Exception as e:
+                print(f"Error processing {key}: {e!r}")
+                entry = dataset.get(key) or {}
+                result = {
+                    "question": entry.get("question"),
+                    "predicted_answer": None,
+                    "correct_answer": entry.get("correct_answer"),
+                    "is_correct": 0,
+                    "error": repr(e),
+                }
+            finally:
+                del frames
+                frame_queue.task_done()
+
+            with lock:
+                try:
+                    results[key] = result
+                    out_file.write(json.dumps({"video_id": key, **result}, default=str) + "\n")
+                    out_file.flush()
+                except Exception as e:
+                    print(f"Error saving the result for {key}: {e!r}")
+                finally:
+                    pbar.update(1)
+
+    with open(os.path.join(RESULTS_DIR, "ego_exo4d_results.jsonl"), "w") as out_file:
+        decoders = [threading.Thread(target=decode_worker, daemon=True) for _ in range(NUM_DECODE_WORKERS)]
+        requesters = [threading.Thread(target=request_worker, args=(out_file,), daemon=True) for _ in range(vllm_client.max_workers)]
+        for t in decoders + requesters:
+            t.start()
+        for t in decoders:
+            t.join()
+        for _ in requesters:
+            frame_queue.put(None)
+        for t in requesters:
+            t.join()
+    pbar.close()
+
+    results = {key: results[key] for key in dataset if key in results}
+    with open(os.path.join(RESULTS_DIR, "ego_exo4d_results.json"), "w") as f:
         json.dump(results, f, indent=4)
 
-    accuracy = total_correct / len(all_entries) if all_entries else 0
+    total_correct = sum(result["is_correct"] for result in results.values())
+    accuracy = total_correct / len(results) if results else 0
     print(f"Accuracy: {accuracy:.2%}")
 
 def main():
+    parser = argparse.ArgumentParser(description="Multiple-choice VQA over ORBIT crops")
+    parser.add_argument("--video-mode", default=VIDEO_MODE, choices=["cropped", "virtual"],
+                        help="cropped: read 3_cropped_videos, virtual: decode frames_of_interest from the source videos")
+    profiling.add_arguments(parser) # stages: load_frames, vqa
+    args = parser.parse_args()
+    profiling.configure_from_args(args)
+
     dataset_path = "/nas/mars/experiment_result/orbit/1_dataset_json/ego_exo4d_dataset.json"
     with open(dataset_path, "r") as f:
         dataset = json.load(f)
@@ -179,7 +283,8 @@ def main():
     vllm_client = VLLMClientMultiprocessing()
     run_experiment(
         dataset=dataset,
-        vllm_client=vllm_client
+        vllm_client=vllm_client,
+        video_mode=args.video_mode,
     )
 
 if __name__ == "__main__":